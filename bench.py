@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import resource
+import collections
+import tracemalloc
+import platform
+import datetime
+import subprocess
+from argparse import ArgumentParser, Namespace
+from typing import Callable, Iterator, Optional, Union
+
+from watchdog.events import (
+    FileSystemEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+    FileClosedEvent,
+    FileOpenedEvent,
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirModifiedEvent,
+    DirMovedEvent,
+)
+
+try:
+    from utils import SimpleDirectorySnapShot, trace_event
+    from observers import SimplePollingEmitter
+    from tricks import SimpleTrick
+    from metrics import METRICS
+except:
+    from .utils import SimpleDirectorySnapShot, trace_event
+    from .observers import SimplePollingEmitter
+    from .tricks import SimpleTrick
+    from .metrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+def generate_tree(root: str, entries: int, fanout: int = 10, files_per_dir: int = 100, depth: int = 0) -> int:
+    '''create a tree of empty files breadth-first and return the number of entries created, depth 0 is unlimited'''
+    count = 0
+    queue = collections.deque([(root, 0)])
+    os.makedirs(root, exist_ok=True)
+    while queue and count < entries:
+        parent, level = queue.popleft()
+        for i in range(files_per_dir):
+            if count >= entries:
+                break
+            open(os.path.join(parent, f'file_{i:05d}.mkv'), 'w').close()
+            count += 1
+        if depth and level >= depth:
+            continue
+        for i in range(fanout):
+            if count >= entries:
+                break
+            path = os.path.join(parent, f'dir_{i:03d}')
+            os.makedirs(path, exist_ok=True)
+            queue.append((path, level + 1))
+            count += 1
+    return count
+
+
+class CountingEntry:
+
+    def __init__(self, entry: os.DirEntry, counter: 'SyscallCounter') -> None:
+        self._entry = entry
+        self._counter = counter
+        self.name = entry.name
+        self.path = entry.path
+        self._stated: set[bool] = set()
+
+    def stat(self, follow_symlinks: bool = True) -> os.stat_result:
+        # DirEntry caches the result, on Windows lstat comes with the listing and only a symlink is followed by a call
+        if follow_symlinks not in self._stated:
+            self._stated.add(follow_symlinks)
+            if os.name != 'nt' or (follow_symlinks and self._entry.is_symlink()):
+                self._counter.counts['stat'] += 1
+                self._counter.wait()
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, follow_symlinks: bool = True) -> bool:
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+
+class SyscallCounter:
+    '''wrap stat() and listdir() to count the calls of a walk, latency imitates a slow mount like FUSE'''
+
+    def __init__(self, stat: Callable = os.stat, listdir: Callable = os.scandir, latency: Union[int, float] = 0) -> None:
+        self._stat = stat
+        self._listdir = listdir
+        self.latency = latency
+        self.counts = {'stat': 0, 'listdir': 0}
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def stat(self, path: str) -> os.stat_result:
+        self.counts['stat'] += 1
+        self.wait()
+        return self._stat(path)
+
+    def listdir(self, path: str) -> Iterator[CountingEntry]:
+        self.counts['listdir'] += 1
+        self.wait()
+        with self._listdir(path) as entries:
+            for entry in entries:
+                yield CountingEntry(entry, self)
+
+
+def bench_walk(path: str, repeat: int = 3, latency: Union[int, float] = 0, **options) -> dict:
+    counter = SyscallCounter()
+    snapshot = SimpleDirectorySnapShot(path, stat=counter.stat, listdir=counter.listdir, **options)
+    elapsed = []
+    for _ in range(repeat):
+        if latency:
+            slow = SyscallCounter(latency=latency)
+            options.update(stat=slow.stat, listdir=slow.listdir)
+        start = time.perf_counter()
+        SimpleDirectorySnapShot(path, **options)
+        elapsed.append(time.perf_counter() - start)
+    options.pop('stat', None)
+    options.pop('listdir', None)
+    return {
+        'options': options,
+        'latency': latency,
+        'entries': len(snapshot._stat_info),
+        'syscalls': counter.counts,
+        'elapsed': min(elapsed),
+    }
+
+
+def bench_walkers(path: str, repeat: int = 3) -> list[dict]:
+    results = []
+    for options in ({}, {'use_direntry': True}):
+        result = bench_walk(path, repeat, **options)
+        logger.info(f'{result}')
+        results.append(result)
+    return results
+
+
+def prepare_changes(path: str, count: int) -> str:
+    changes = os.path.join(path, '_bench_changes')
+    shutil.rmtree(changes, ignore_errors=True)
+    os.makedirs(changes)
+    for i in range(count * 3):
+        open(os.path.join(changes, f'change_{i:05d}.mkv'), 'w').close()
+    return changes
+
+
+def apply_changes(changes: str, count: int) -> None:
+    '''modify, move and delete count files each and create count files'''
+    for i in range(count):
+        with open(os.path.join(changes, f'change_{i:05d}.mkv'), 'a') as file:
+            file.write('changed')
+        os.rename(os.path.join(changes, f'change_{count + i:05d}.mkv'), os.path.join(changes, f'moved_{i:05d}.mkv'))
+        open(os.path.join(changes, f'created_{i:05d}.mkv'), 'w').close()
+    # after creating so that the inodes are not reused
+    for i in range(count):
+        os.remove(os.path.join(changes, f'change_{count * 2 + i:05d}.mkv'))
+
+
+def bench_diff(path: str, engine: str, changes: int = 100) -> dict:
+    '''take two snapshots around some changes and diff them, run in a fresh process to measure the peak RSS'''
+    snapshot_class, diff = SimplePollingEmitter.DIFF_ENGINES[engine]
+    folder = prepare_changes(path, changes)
+    try:
+        start = time.perf_counter()
+        ref = snapshot_class(path)
+        snapshot_elapsed = time.perf_counter() - start
+        time.sleep(0.01)
+        apply_changes(folder, changes)
+        snapshot = snapshot_class(path)
+        start = time.perf_counter()
+        events = diff(ref, snapshot)
+        diff_elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return {
+        'engine': engine,
+        'entries': len(snapshot._stat_info),
+        'snapshot': snapshot_elapsed,
+        'diff': diff_elapsed,
+        'events': {
+            name: len(getattr(events, name)) for name in
+            ('files_created', 'files_deleted', 'files_modified', 'files_moved', 'dirs_created', 'dirs_deleted', 'dirs_modified', 'dirs_moved')
+        },
+        # kilobytes on linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def bench_memory(path: str) -> list[dict]:
+    '''traced memory per entry of a snapshot of each diff engine'''
+    results = []
+    for engine, (snapshot_class, _) in SimplePollingEmitter.DIFF_ENGINES.items():
+        tracemalloc.start()
+        snapshot = snapshot_class(path)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entries = len(snapshot._stat_info)
+        result = {
+            'engine': engine,
+            'class': snapshot_class.__name__,
+            'entries': entries,
+            'bytes_per_entry': size / entries,
+            'peak_bytes_per_entry': peak / entries,
+        }
+        del snapshot
+        logger.info(f'{result}')
+        results.append(result)
+    return results
+
+
+def bench_diff_engines(path: str, changes: int = 100, engines: Optional[list] = None) -> list[dict]:
+    results = []
+    for engine in engines or SimplePollingEmitter.DIFF_ENGINES:
+        command = [sys.executable, os.path.abspath(__file__), path, '--diff-engine', engine, '--changes', str(changes)]
+        result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)[0]
+        logger.info(f'{result}')
+        results.append(result)
+    return results
+
+
+def bench_dispatch(events: int = 100_000, conduits: int = 5, async_dispatch: bool = False) -> dict:
+    '''events per second from TrickBase.dispatch() through a chain of DummyConduits'''
+    trick = SimpleTrick(
+        patterns=['*.mkv'],
+        conduits=[{'class': 'conduits.DummyConduit', 'name': f'dummy-{i}'} for i in range(conduits)],
+        async_dispatch=async_dispatch,
+    )
+    paths = [f'/bench/dir_{i % 1000:03d}/file_{i:07d}.mkv' for i in range(events)]
+    # measure the dispatch, not the debug line of every delivery
+    trace_logger = logging.getLogger(trace_event.__module__)
+    level = trace_logger.level
+    trace_logger.setLevel(logging.INFO)
+    try:
+        start = time.perf_counter()
+        for path in paths:
+            trick.dispatch(FileCreatedEvent(path))
+        # wait for the deliveries on the event loop
+        trick.stop()
+        elapsed = time.perf_counter() - start
+    finally:
+        trace_logger.setLevel(level)
+    return {
+        'events': events,
+        'conduits': conduits,
+        'async_dispatch': async_dispatch,
+        'elapsed': elapsed,
+        'events_per_second': events / elapsed,
+    }
+
+
+def describe() -> dict:
+    '''what the results were measured with'''
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except Exception:
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def bench_suite(root: str, sizes: list[int], fanout: int = 10, files_per_dir: int = 100, depth: int = 0,
+                latency: Union[int, float] = 0, repeat: int = 3, changes: int = 100, engines: Optional[list] = None,
+                events: int = 100_000, conduits: int = 5, async_dispatch: bool = False) -> dict:
+    '''walk, diff and dispatch on a generated tree of each size, the trees are kept under root for the next run'''
+    results = []
+    for size in sizes:
+        path = os.path.join(root, f'tree-{size}-{fanout}-{files_per_dir}-{depth}')
+        if not os.path.exists(path):
+            logger.info(f'Generating {size} entries: {path!r}')
+            generate_tree(path, size, fanout, files_per_dir, depth)
+        result = {
+            'size': size,
+            'walk': bench_walk(path, repeat, latency),
+            'diff': bench_diff_engines(path, changes, engines),
+        }
+        logger.info(f'{result}')
+        results.append(result)
+    dispatch = bench_dispatch(events, conduits, async_dispatch) if events else None
+    logger.info(f'{dispatch}')
+    return {
+        'describe': describe(),
+        'options': {
+            'fanout': fanout, 'files_per_dir': files_per_dir, 'depth': depth, 'latency': latency,
+            'repeat': repeat, 'changes': changes,
+        },
+        'sizes': results,
+        'dispatch': dispatch,
+    }
+
+
+def compare_suites(base: dict, current: dict) -> list[str]:
+    '''the change of each measurement from base, negative is faster or smaller'''
+    def change(old: Optional[float], new: Optional[float]) -> str:
+        return f'{old:.4g} -> {new:.4g} ({(new - old) / old:+.1%})' if old and new is not None else f'{old} -> {new}'
+
+    lines = []
+    base_sizes = {result['size']: result for result in base.get('sizes', [])}
+    for result in current.get('sizes', []):
+        old = base_sizes.get(result['size'])
+        if not old:
+            continue
+        lines.append(f'{result["size"]} walk: {change(old["walk"]["elapsed"], result["walk"]["elapsed"])}')
+        old_diffs = {diff['engine']: diff for diff in old['diff']}
+        for diff in result['diff']:
+            if diff['engine'] not in old_diffs:
+                continue
+            old_diff = old_diffs[diff['engine']]
+            lines.append(f'{result["size"]} {diff["engine"]} diff: {change(old_diff["diff"], diff["diff"])}')
+            lines.append(f'{result["size"]} {diff["engine"]} peak_rss: {change(old_diff["peak_rss"], diff["peak_rss"])}')
+    if base.get('dispatch') and current.get('dispatch'):
+        lines.append(f'dispatch events/s: {change(base["dispatch"]["events_per_second"], current["dispatch"]["events_per_second"])}')
+    return lines
+
+
+# (event_type, is_directory) -> event class
+EVENT_CLASSES = {
+    ('created', False): FileCreatedEvent,
+    ('deleted', False): FileDeletedEvent,
+    ('modified', False): FileModifiedEvent,
+    ('moved', False): FileMovedEvent,
+    ('closed', False): FileClosedEvent,
+    ('opened', False): FileOpenedEvent,
+    ('created', True): DirCreatedEvent,
+    ('deleted', True): DirDeletedEvent,
+    ('modified', True): DirModifiedEvent,
+    ('moved', True): DirMovedEvent,
+}
+# 0.5ms to about 2 minutes by 25%
+LATENCY_BUCKETS = tuple(round(0.0005 * 1.25 ** i, 6) for i in range(56))
+
+
+def read_events(file: str) -> Iterator[dict]:
+    '''the events of a JSON lines file written by RecordConduit'''
+    with open(file) as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def to_event(event: dict) -> FileSystemEvent:
+    event_class = EVENT_CLASSES[(event['event_type'], bool(event.get('is_directory')))]
+    if event['event_type'] == 'moved':
+        return event_class(event['src_path'], event['dest_path'])
+    return event_class(event['src_path'])
+
+
+def is_watched(path: str, dirs: list[str], recursive: bool) -> bool:
+    for folder in dirs:
+        if recursive and (path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)):
+            return True
+        if not recursive and os.path.dirname(path) == folder.rstrip(os.sep):
+            return True
+    return False
+
+
+def replay_events(handlers: list[tuple], events: Iterator[dict], speed: float = 0) -> dict:
+    '''
+    dispatch the events to the handlers watching their paths and stop the handlers to drain the conduits
+
+    handlers: [(trick, dirs, recursive)]
+    speed: 1 keeps the recorded intervals, 2 is twice as fast, 0 sends at once
+    '''
+    count = 0
+    first = None
+    start = time.perf_counter()
+    for event in events:
+        if speed and event.get('time'):
+            first = first or event['time']
+            delay = (event['time'] - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        watchdog_event = to_event(event)
+        for handler, dirs, recursive in handlers:
+            if is_watched(event['src_path'], dirs, recursive) or (event.get('dest_path') and is_watched(event['dest_path'], dirs, recursive)):
+                handler.dispatch(watchdog_event)
+        count += 1
+    dispatched = time.perf_counter() - start
+    for handler, _, _ in handlers:
+        if hasattr(handler, 'stop'):
+            handler.stop()
+    elapsed = time.perf_counter() - start
+    conduits = {}
+    for handler, _, _ in handlers:
+        for conduit in getattr(handler, 'conduits', []):
+            histogram = METRICS.get('watcher_conduit_flow_seconds', conduit=conduit.name)
+            if not histogram:
+                continue
+            conduits[conduit.name] = {
+                'deliveries': histogram.count,
+                'errors': METRICS.get('watcher_conduit_errors_total', conduit=conduit.name) or 0,
+                'mean': histogram.sum / histogram.count,
+                **{f'p{round(q * 100)}': METRICS.quantile('watcher_conduit_flow_seconds', q, conduit=conduit.name) for q in (0.5, 0.9, 0.99)},
+            }
+    return {
+        'events': count,
+        'dispatched': dispatched,
+        'elapsed': elapsed,
+        'events_per_second': count / elapsed if elapsed else 0,
+        'conduits': conduits,
+    }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = ArgumentParser(description='Compare the polling walkers on a generated tree.')
+    parser.add_argument('path', help='A directory for the generated tree.')
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--files-per-dir', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--diff', action='store_true', help='Compare the diff engines instead of the walkers.')
+    parser.add_argument('--diff-engine', choices=list(SimplePollingEmitter.DIFF_ENGINES), help='Run one diff engine in this process.')
+    parser.add_argument('--changes', type=int, default=100)
+    parser.add_argument('--memory', action='store_true', help='Compare the memory per entry of the snapshots.')
+    args: Namespace = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname).1s %(message)s')
+    if not os.path.exists(args.path):
+        logger.info(f'Generating {args.entries} entries: {args.path!r}')
+        generate_tree(args.path, args.entries, args.fanout, args.files_per_dir)
+    if args.diff_engine:
+        results = [bench_diff(args.path, args.diff_engine, args.changes)]
+    elif args.memory:
+        results = bench_memory(args.path)
+    elif args.diff:
+        results = bench_diff_engines(args.path, args.changes)
+    else:
+        results = bench_walkers(args.path, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,30 @@
 import time
+import json
+import traceback
 import functools
+import itertools
+import collections
 import logging
+import asyncio
+import threading
 import shlex
 import subprocess
 import datetime
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Union, Any
+from typing import Optional, Union, Any, Generator
 
 from watchdog.utils.process_watcher import ProcessWatcher
 
 try:
-    from utils import request, parse_mappings, map_path, parse_json_response, trace_event
+    from utils import request, async_request, import_aiohttp, parse_mappings, map_path, parse_json_response, trace_event, TTLCache, PathTrie, RateLimiter
+    from dispatchers import Batcher
+    from metrics import METRICS
 except:
-    from .utils import request, parse_mappings, map_path, parse_json_response, trace_event
+    from .utils import request, async_request, import_aiohttp, parse_mappings, map_path, parse_json_response, trace_event, TTLCache, PathTrie, RateLimiter
+    from .dispatchers import Batcher
+    from .metrics import METRICS
 
 
 logger = logging.getLogger(__name__)
@@ -21,15 +32,44 @@ logger = logging.getLogger(__name__)
 
 class ConduitBase:
 
-    def __init__(self, name: str, events: list, priority: int, mappings: Optional[list[str]] = None) -> None:
+    # the default rate_limit of the service, applied only once the conduit runs on a thread of its own
+    RATE_LIMIT: Optional[dict] = None
+
+    def __init__(self, name: str, events: list, priority: int, mappings: Optional[list[str]] = None,
+                 rate_limit: Optional[dict] = None) -> None:
         self.name = name
         self.events = events
         self.priority = priority
         self.mappings = parse_mappings(mappings) if mappings else None
+        # {'rate': 5, 'burst': 10, 'max_in_flight': 2}, false to turn off the default
+        self.rate_limit = rate_limit
+        self.limiter = RateLimiter(name, **rate_limit) if rate_limit else None
+        # raise on a failed request instead of logging it, turned on when the journal has to retry the event
+        self.raise_errors = False
+
+    def use_default_rate_limit(self) -> None:
+        '''called when the conduit gets a queue, a journal reader or a batcher so that waiting does not hold the observer'''
+        if self.rate_limit is None and self.RATE_LIMIT and not self.limiter:
+            self.limiter = RateLimiter(self.name, **self.RATE_LIMIT)
 
     def flow(self, event: dict[str, Union[str, bool]]) -> None:
         raise Exception('You must override this method.')
 
+    def stop(self) -> None:
+        '''called once the watcher is stopping'''
+
+
+class AsyncConduitBase(ConduitBase):
+    '''flow() is a coroutine run on the event loop of dispatchers.AsyncEngine'''
+
+    def __init__(self, *args, **kwds) -> None:
+        super(AsyncConduitBase, self).__init__(*args, **kwds)
+        # install aiohttp now if needed, not on the event loop
+        import_aiohttp()
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        raise Exception('You must override this method.')
+
 
 class DummyConduit(ConduitBase):
 
@@ -38,6 +78,27 @@ class DummyConduit(ConduitBase):
         '''override'''
 
 
+class RecordConduit(ConduitBase):
+    '''append the events to a JSON lines file to replay them with `watcher.py load`'''
+
+    def __init__(self, *args, file: str, **kwds) -> None:
+        super(RecordConduit, self).__init__(*args, **kwds)
+        self.file = open(file, 'a')
+        self._lock = threading.Lock()
+
+    def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        line = json.dumps({'time': time.time(), **event})
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def stop(self) -> None:
+        '''override'''
+        with self._lock:
+            self.file.close()
+
+
 class RcloneConduit(ConduitBase):
 
     def __init__(self, *args: tuple,
@@ -45,18 +106,45 @@ class RcloneConduit(ConduitBase):
                  rc_user: Optional[str] = None,
                  rc_pass: Optional[str] = None,
                  vfs: Optional[str] = None,
+                 batch_window: Union[int, float] = 0,
+                 batch_size: int = 50,
+                 batch_recursive: bool = False,
+                 metadata_stats: bool = False,
+                 exists_cache_ttl: Union[int, float] = 30,
+                 exists_cache_size: int = 10000,
                  **kwds) -> None:
         super(RcloneConduit, self).__init__(*args, **kwds)
         self.rc_url = rc_url.strip().strip('/')
         self.rc_user = rc_user.strip()
         self.rc_pass = rc_pass.strip()
         self.vfs = vfs.strip()
+        # log the changes of the vfs metadata cache with two more vfs/stats calls per refresh
+        self.metadata_stats = metadata_stats
+        self.batch_recursive = batch_recursive
+        self.batcher = Batcher(self.name, self.refresh_batch, batch_window, batch_size) if batch_window else None
+        # remote directory -> False while vfs/refresh says it does not exist, so that it is not probed again
+        self.exists_cache = TTLCache(exists_cache_size, exists_cache_ttl)
 
     def flow(self, event: dict[str, Union[str, bool]]) -> None:
         '''override'''
-        self.refresh(event.get('src_path'), event.get('is_directory'))
+        paths = [event.get('src_path')]
         if event.get('event_type') == 'moved':
-            self.refresh(event.get('dest_path'), event.get('is_directory'))
+            paths.append(event.get('dest_path'))
+        for path in paths:
+            if self.batcher:
+                remote_dir = self.get_remote_dir(path, event.get('is_directory'))
+                self.batcher.put(remote_dir, (remote_dir, path, event.get('is_directory')))
+            else:
+                self.refresh(path, event.get('is_directory'))
+
+    def stop(self) -> None:
+        '''override'''
+        if self.batcher:
+            self.batcher.stop()
+
+    def get_remote_dir(self, local_path: str, is_directory: bool = False) -> str:
+        remote_path = Path(map_path(local_path, self.mappings)) if self.mappings else Path(local_path)
+        return str(remote_path) if is_directory else str(remote_path.parent)
 
     def command(method: callable) -> callable:
         @functools.wraps(method)
@@ -68,7 +156,7 @@ class RcloneConduit(ConduitBase):
             # {'result': {'/path/to': 'Invalid...'}}
             # {'result': {'/path/to': 'OK'}}
             # {'forgotten': ['/path/to']}
-            return parse_json_response(request("JSON", f'{self.rc_url}/{command}', data=data, auth=(self.rc_user, self.rc_pass)))
+            return parse_json_response(request("JSON", f'{self.rc_url}/{command}', data=data, auth=(self.rc_user, self.rc_pass), limiter=self.limiter, raise_errors=self.raise_errors))
         return wrapper
 
     def get_metadata_cache(self) -> tuple[int, int]:
@@ -82,12 +170,15 @@ class RcloneConduit(ConduitBase):
         return {'fs': fs}
 
     @command
-    def vfs__refresh(self, remote_path: str, fs: str, recursive: bool = False) -> dict[str, Any]:
-        return {
+    def vfs__refresh(self, remote_path: Union[str, list[str]], fs: str, recursive: bool = False) -> dict[str, Any]:
+        data = {
             'fs': fs,
-            'dir': remote_path,
             'recursive': str(recursive).lower()
         }
+        # dir, dir2, dir3, ...
+        for index, path in enumerate([remote_path] if isinstance(remote_path, str) else remote_path, 1):
+            data['dir' if index == 1 else f'dir{index}'] = path
+        return data
 
     @command
     def operations__stat(self, remote_path: str, fs: str, opts: Optional[dict] = None) -> dict[str, Any]:
@@ -104,51 +195,158 @@ class RcloneConduit(ConduitBase):
         item = result.get('item', {})
         return (item.get('IsDir').lower() == 'true') if item else False
 
-    def _refresh(self, remote_path: str, fs: str, recursive: bool = False) -> dict[str, Any]:
-        start_dirs, start_files = self.get_metadata_cache()
+    def _refresh(self, remote_path: Union[str, list[str]], fs: str, recursive: bool = False) -> dict[str, Any]:
+        if self.metadata_stats:
+            start_dirs, start_files = self.get_metadata_cache()
         start = time.time()
         result: dict = self.vfs__refresh(remote_path, fs, recursive)
         elapsed = time.time() - start
-        dirs, files = self.get_metadata_cache()
-        logger.info(f'dirs={dirs - start_dirs} files={files - start_files} elapsed={elapsed:.1f}s result="{result.get("result")!r}"')
+        METRICS.observe('watcher_rclone_refresh_seconds', elapsed, conduit=self.name)
+        self.remember(result)
+        if self.metadata_stats:
+            dirs, files = self.get_metadata_cache()
+            logger.info(f'dirs={dirs - start_dirs} files={files - start_files} elapsed={elapsed:.1f}s result="{result.get("result")!r}"')
+        else:
+            logger.info(f'elapsed={elapsed:.1f}s result="{result.get("result")!r}"')
         return result
 
-    def refresh(self, local_path: str, is_directory: bool = False) -> None:
+    def remember(self, result: dict) -> None:
+        for path, status in (result.get('result') or {}).items():
+            match status:
+                case 'OK':
+                    # a present directory is refreshed anyway, only the missing ones are worth remembering
+                    self.exists_cache.pop(path)
+                case 'file does not exist':
+                    self.exists_cache.set(path, False)
+
+    def refresh_batch(self, items: list[tuple[str, str, bool]]) -> None:
+        missing = [item for item in items if self.exists_cache.get(item[0]) is False]
+        items = [item for item in items if item not in missing]
+        for remote_dir, local_path, is_directory in missing:
+            self.refresh(local_path, is_directory)
+        if not items:
+            return
+        remote_dirs = sorted(item[0] for item in items)
+        if self.batch_recursive:
+            # a recursive refresh of a pending ancestor covers its descendants
+            covered = set()
+            for remote_dir in remote_dirs:
+                if any(Path(remote_dir).is_relative_to(ancestor) for ancestor in covered):
+                    continue
+                covered.add(remote_dir)
+            remote_dirs = sorted(covered)
+        logger.debug(f'Batch refresh: {len(remote_dirs)} of {len(items)} directories')
+        result: dict = self._refresh(remote_dirs, self.vfs, self.batch_recursive).get('result') or {}
+        requested_dirs = set(remote_dirs)
+        for remote_dir, local_path, is_directory in items:
+            requested = remote_dir
+            if remote_dir not in requested_dirs:
+                # replaced in the batch by a recursive refresh of its ancestor
+                requested = next((d for d in remote_dirs if Path(remote_dir).is_relative_to(d)), remote_dir)
+            if result.get(requested) == 'file does not exist':
+                # find the nearest existing ancestor one by one
+                self.refresh(local_path, is_directory)
+
+    def refresh_steps(self, local_path: str, is_directory: bool = False) -> Generator[Union[str, Path], Union[dict, bool], None]:
+        '''
+        yield the remote paths to be refreshed in order and receive the results of vfs/refresh
+
+        A local Path is yielded instead to ask whether it exists, so that the caller decides where to stat the mount.
+        '''
         local_path = Path(local_path)
         remote_path = Path(map_path(str(local_path), self.mappings)) if self.mappings else local_path
         parents: list[Path] = list(remote_path.parents)
         to_be_tested = str(remote_path) if is_directory else str(parents.pop(0))
         not_exists_paths = []
-        result = self._refresh(to_be_tested, self.vfs)
-        while result['result'].get(to_be_tested) == 'file does not exist':
+        # do not probe again the directories that were missing a moment ago
+        while parents and self.exists_cache.get(to_be_tested) is False:
+            not_exists_paths.insert(0, to_be_tested)
+            to_be_tested = str(parents.pop(0))
+        result = yield to_be_tested
+        while (result.get('result') or {}).get(to_be_tested) == 'file does not exist':
             not_exists_paths.insert(0, to_be_tested)
             if parents:
                 to_be_tested = str(parents.pop(0))
-                result = self._refresh(to_be_tested, self.vfs)
+                result = yield to_be_tested
             else:
                 logger.warning(f'Hit the top-level path.')
                 break
         for path in not_exists_paths:
-            if local_path.exists():
+            if (yield local_path):
                 break
-            result = self._refresh(path, self.vfs)
-            if not result.get(path) == 'OK':
+            result = yield path
+            if not (result.get('result') or {}).get(path) == 'OK':
                 break
 
+    def refresh(self, local_path: str, is_directory: bool = False) -> None:
+        steps = self.refresh_steps(local_path, is_directory)
+        try:
+            step = next(steps)
+            while True:
+                step = steps.send(step.exists() if isinstance(step, Path) else self._refresh(step, self.vfs))
+        except StopIteration:
+            pass
+
 
 class PlexConduit(ConduitBase):
 
-    def __init__(self, *args, plex_url: str, plex_token: str, **kwds) -> None:
+    def __init__(self, *args, plex_url: str, plex_token: str,
+                 sections_ttl: Union[int, float] = 600,
+                 scan_window: Union[int, float] = 0,
+                 scan_concurrency: int = 1,
+                 scan_workers: int = 4,
+                 **kwds) -> None:
         super(PlexConduit, self).__init__(*args, **kwds)
         self.plex_url = plex_url.strip().strip('/')
         self.plex_token = plex_token.strip()
+        # location -> section key
+        self.sections_ttl = sections_ttl
+        self._section_index: Optional[PathTrie] = None
+        self._section_index_at = 0
+        # a path in no section refetches the sections at most once per sections_ttl
+        self._section_missed_at = 0
+        self._sections_lock = threading.Lock()
+        # one partial scan per folder, at most scan_concurrency requests in flight per section
+        # plex answers a refresh right away and scans on its own, so this does not limit the scans of plex
+        self.batcher = Batcher(self.name, self.scan_batch, scan_window, 1000) if scan_window else None
+        self.executor = ThreadPoolExecutor(max_workers=scan_workers, thread_name_prefix=f'{self.name}-scan') if scan_window else None
+        self.scan_concurrency = max(int(scan_concurrency), 1)
+        self._section_slots: dict[int, threading.BoundedSemaphore] = {}
 
     def flow(self, event: dict[str, Union[str, bool]]) -> None:
         '''override'''
         if not event['is_directory']:
-            self.scan(event['src_path'])
+            paths = [event['src_path']]
             if event.get('event_type') == 'moved':
-                self.scan(event['dest_path'])
+                paths.append(event['dest_path'])
+            for path in paths:
+                if self.batcher:
+                    self.batcher.put(str(Path(path).parent))
+                else:
+                    self.scan(path)
+
+    def stop(self) -> None:
+        '''override'''
+        if self.batcher:
+            self.batcher.stop()
+            self.executor.shutdown(wait=True)
+
+    def scan_batch(self, folders: list[str]) -> None:
+        logger.debug(f'Scan {len(folders)} folders')
+        for folder in folders:
+            self.executor.submit(self.scan_folder, folder)
+
+    def scan_folder(self, folder: str) -> None:
+        # nobody waits for the futures of the executor
+        try:
+            self.scan(folder)
+        except Exception:
+            logger.error(f'Could not scan: {folder!r}')
+            logger.error(traceback.format_exc())
+
+    def get_section_slot(self, section: int) -> threading.BoundedSemaphore:
+        with self._sections_lock:
+            return self._section_slots.setdefault(section, threading.BoundedSemaphore(self.scan_concurrency))
 
     def api(func: callable) -> callable:
         @functools.wraps(func)
@@ -159,7 +357,7 @@ class PlexConduit(ConduitBase):
             params['X-Plex-Token'] = self.plex_token
             headers = {'Accept': 'application/json'}
             logger.debug(f'{key}: {params}')
-            return parse_json_response(request(method, f'{self.plex_url}{key}', params=params, headers=headers))
+            return parse_json_response(request(method, f'{self.plex_url}{key}', params=params, headers=headers, limiter=self.limiter, raise_errors=self.raise_errors))
         return wrapper
 
     @api
@@ -181,18 +379,50 @@ class PlexConduit(ConduitBase):
             'method': 'GET'
         }
 
-    def get_section_by_path(self, path: str) -> int:
-        plex_path = Path(map_path(path, self.mappings)) if self.mappings else Path(path)
-        sections = self.sections()
-        for directory in sections['MediaContainer']['Directory']:
-            for location in directory['Location']:
-                if plex_path.is_relative_to(location['path']) or \
-                   Path(location['path']).is_relative_to(plex_path):
-                    return int(directory['key'])
+    def refresh_sections(self, stale: Optional[PathTrie] = None) -> PathTrie:
+        with self._sections_lock:
+            # another thread has refreshed it while waiting for the lock
+            if self._section_index is not None and self._section_index is not stale:
+                return self._section_index
+            sections = self.sections()
+            try:
+                index = PathTrie()
+                for directory in sections['MediaContainer']['Directory']:
+                    for location in directory['Location']:
+                        index.setdefault(location['path'], int(directory['key']))
+            except Exception:
+                logger.error(f'Could not get the library sections: {sections}')
+                return self._section_index or PathTrie()
+            logger.debug(f'Library sections: {len(index)} locations')
+            self._section_index = index
+            self._section_index_at = time.time()
+            return index
+
+    def get_section_by_path(self, path: str) -> Optional[int]:
+        plex_path = map_path(path, self.mappings) if self.mappings else path
+        index = self._section_index
+        if index is None or time.time() - self._section_index_at > self.sections_ttl:
+            index = self.refresh_sections(index)
+        # the path is in a location or a location is in the path
+        section = index.longest_prefix(plex_path)
+        if section is None:
+            section = index.first_below(plex_path)
+        if section is None and index is self._section_index and time.time() - self._section_missed_at > self.sections_ttl:
+            self._section_missed_at = time.time()
+            index = self.refresh_sections(index)
+            section = index.longest_prefix(plex_path)
+            if section is None:
+                section = index.first_below(plex_path)
+        return section
 
     def scan(self, path: str, force: bool = False) -> None:
         section = self.get_section_by_path(path)
-        self.refresh(section, path, force)
+        if section is None:
+            logger.warning(f'No library section for {path!r}')
+            return
+        plex_path = map_path(path, self.mappings) if self.mappings else path
+        with self.get_section_slot(section):
+            self.refresh(section, plex_path, force)
 
 
 class FFConduit(ConduitBase):
@@ -218,10 +448,10 @@ class FFConduit(ConduitBase):
                 logger.debug(f'{command}: {data}')
                 match method:
                     case 'POST':
-                        return parse_json_response(request('POST', f'{self.ff_url}/{command}', data=data))
+                        return parse_json_response(request('POST', f'{self.ff_url}/{command}', data=data, limiter=self.limiter, raise_errors=self.raise_errors))
                     case 'GET':
                         query = urllib.parse.urlencode(data)
-                        return parse_json_response(request('GET', f'{self.ff_url}/{command}?{query}'))
+                        return parse_json_response(request('GET', f'{self.ff_url}/{command}?{query}', limiter=self.limiter, raise_errors=self.raise_errors))
             return wrapper
         return decorator
 
@@ -331,11 +561,33 @@ class MessenserConduit(ConduitBase):
 class DiscordConduit(MessenserConduit):
 
     API_URL = 'https://discord.com/api'
-
-    def __init__(self, *args, webhook_id: str, webhook_token: str, **kwds) -> None:
+    # 30 messages per minute for a webhook
+    RATE_LIMIT = {'rate': 0.5, 'burst': 5}
+    # a message takes up to 10 embeds of 6000 characters in total
+    MAX_EMBEDS = 10
+    MAX_CHARACTERS = 6000
+    BATCH_MODES = ('embeds', 'summary')
+
+    def __init__(self, *args, webhook_id: str, webhook_token: str,
+                 batch_window: Union[int, float] = 0,
+                 batch_size: Optional[int] = None,
+                 batch_mode: str = 'embeds',
+                 summary_names: int = 5,
+                 **kwds) -> None:
         super(DiscordConduit, self).__init__(*args, **kwds)
         self.webhook_id = webhook_id
         self.webhook_token = webhook_token
+        if batch_mode not in self.BATCH_MODES:
+            raise ValueError(f'{batch_mode} not in {self.BATCH_MODES}')
+        # embeds: one embed per event, summary: one embed per folder with the counts per event type
+        self.batch_mode = batch_mode
+        self.summary_names = summary_names
+        if batch_mode == 'embeds':
+            batch_size = min(batch_size or self.MAX_EMBEDS, self.MAX_EMBEDS)
+        self.batcher = Batcher(self.name, self.send_batch, batch_window, batch_size or 1000) if batch_window else None
+        if self.batcher:
+            self.use_default_rate_limit()
+        self._sequence = itertools.count()
 
     @property
     def headers(self) -> dict:
@@ -351,7 +603,7 @@ class DiscordConduit(MessenserConduit):
             api = params.pop('api')
             method = params.pop('method')
             logger.debug(f'{params}')
-            return parse_json_response(request(method, f'{self.API_URL}{api}', json=params, headers=self.headers))
+            return parse_json_response(request(method, f'{self.API_URL}{api}', json=params, headers=self.headers, limiter=self.limiter, raise_errors=self.raise_errors))
         return wrapper
 
     @api
@@ -369,12 +621,206 @@ class DiscordConduit(MessenserConduit):
 
     def flow(self, event: dict[str, Union[str, bool]]) -> None:
         '''override'''
+        if self.batcher:
+            # every event is an item of its own
+            self.batcher.put(next(self._sequence), dict(event) if self.batch_mode == 'summary' else self.embed(event))
+        else:
+            self.webhook(embeds=[self.embed(event)])
+
+    def stop(self) -> None:
+        '''override'''
+        if self.batcher:
+            self.batcher.stop()
+
+    def send_batch(self, items: list[dict]) -> None:
+        embeds = self.summarize(items) if self.batch_mode == 'summary' else items
+        for chunk in self.pack(embeds):
+            self.webhook(embeds=chunk)
+
+    def pack(self, embeds: list[dict]) -> Generator[list[dict], None, None]:
+        chunk, characters = [], 0
+        for embed in embeds:
+            length = len(embed.get('title', '')) + len(embed.get('description', ''))
+            if chunk and (len(chunk) >= self.MAX_EMBEDS or characters + length > self.MAX_CHARACTERS):
+                yield chunk
+                chunk, characters = [], 0
+            chunk.append(embed)
+            characters += length
+        if chunk:
+            yield chunk
+
+    def summarize(self, events: list[dict]) -> list[dict]:
+        '''one embed per folder: the counts per event type and the first names'''
+        counts: dict[str, collections.Counter] = {}
+        names: dict[str, list[str]] = {}
+        for event in events:
+            path = event["dest_path"] if event["event_type"] == 'moved' else event["src_path"]
+            target_path = Path(map_path(path, self.mappings) if self.mappings else path)
+            folder = str(target_path.parent)
+            counts.setdefault(folder, collections.Counter())[event["event_type"]] += 1
+            names.setdefault(folder, []).append(target_path.name)
+        _now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        embeds = []
+        for folder, counter in counts.items():
+            lines = [' '.join(f'{event_type}: {count}' for event_type, count in counter.most_common())]
+            lines.extend(name[:200] for name in names[folder][:self.summary_names])
+            if len(names[folder]) > self.summary_names:
+                lines.append(f'... {len(names[folder]) - self.summary_names} more')
+            embeds.append({
+                'type': 'rich',
+                # the title takes 256 characters, keep the end of the path
+                'title': folder if len(folder) <= 256 else '...' + folder[-253:],
+                'description': '\n'.join(lines) + f'\n\n{_now}',
+            })
+        return embeds
+
+    def embed(self, event: dict[str, Union[str, bool]]) -> dict:
         path = event["dest_path"] if event["event_type"] == 'moved' else event["src_path"]
         _now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
         target_path = map_path(path, self.mappings) if self.mappings else path
-        embed = {
+        return {
             'type': 'rich',
             'title': event["event_type"],
             'description': f'{target_path}\n\n{_now}',
         }
-        self.webhook(embeds=[embed])
+
+
+class AsyncRcloneConduit(RcloneConduit, AsyncConduitBase):
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        if self.batcher:
+            return super(AsyncRcloneConduit, self).flow(event)
+        await self.refresh_async(event.get('src_path'), event.get('is_directory'))
+        if event.get('event_type') == 'moved':
+            await self.refresh_async(event.get('dest_path'), event.get('is_directory'))
+
+    async def rc(self, command: str, data: dict) -> dict[str, Any]:
+        logger.debug(f'{command}: {data}')
+        return await async_request('JSON', f'{self.rc_url}/{command}', data=data, auth=(self.rc_user, self.rc_pass), limiter=self.limiter, raise_errors=self.raise_errors)
+
+    async def get_metadata_cache_async(self) -> tuple[int, int]:
+        result = (await self.rc('vfs/stats', RcloneConduit.vfs__stats.__wrapped__(self, self.vfs))).get("metadataCache", {})
+        if not result:
+            logger.error(f'No metadata cache statistics, assumed 0...')
+        return result.get('dirs', 0), result.get('files', 0)
+
+    async def _refresh_async(self, remote_path: Union[str, list[str]], fs: str, recursive: bool = False) -> dict[str, Any]:
+        if self.metadata_stats:
+            start_dirs, start_files = await self.get_metadata_cache_async()
+        start = time.time()
+        result = await self.rc('vfs/refresh', RcloneConduit.vfs__refresh.__wrapped__(self, remote_path, fs, recursive))
+        elapsed = time.time() - start
+        METRICS.observe('watcher_rclone_refresh_seconds', elapsed, conduit=self.name)
+        self.remember(result)
+        if self.metadata_stats:
+            dirs, files = await self.get_metadata_cache_async()
+            logger.info(f'dirs={dirs - start_dirs} files={files - start_files} elapsed={elapsed:.1f}s result="{result.get("result")!r}"')
+        else:
+            logger.info(f'elapsed={elapsed:.1f}s result="{result.get("result")!r}"')
+        return result
+
+    async def refresh_async(self, local_path: str, is_directory: bool = False) -> None:
+        steps = self.refresh_steps(local_path, is_directory)
+        try:
+            step = next(steps)
+            while True:
+                if isinstance(step, Path):
+                    # a stat on the mount is a round trip to the remote, keep it off the event loop
+                    step = steps.send(await asyncio.to_thread(step.exists))
+                else:
+                    step = steps.send(await self._refresh_async(step, self.vfs))
+        except StopIteration:
+            pass
+
+
+class AsyncPlexConduit(PlexConduit, AsyncConduitBase):
+
+    def __init__(self, *args, **kwds) -> None:
+        super(AsyncPlexConduit, self).__init__(*args, **kwds)
+        # used only on the event loop, so no lock
+        self._async_section_slots: dict[int, asyncio.Semaphore] = {}
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        if self.batcher:
+            return super(AsyncPlexConduit, self).flow(event)
+        if not event['is_directory']:
+            await self.scan_async(event['src_path'])
+            if event.get('event_type') == 'moved':
+                await self.scan_async(event['dest_path'])
+
+    async def scan_async(self, path: str, force: bool = False) -> None:
+        # the section index is cached, so this rarely leaves the thread pool waiting for plex
+        section = await asyncio.to_thread(self.get_section_by_path, path)
+        if section is None:
+            logger.warning(f'No library section for {path!r}')
+            return
+        plex_path = map_path(path, self.mappings) if self.mappings else path
+        params: dict = PlexConduit.refresh.__wrapped__(self, section, plex_path, force)
+        key = params.pop('key')
+        method = params.pop('method')
+        params['X-Plex-Token'] = self.plex_token
+        logger.debug(f'{key}: {params}')
+        slot = self._async_section_slots.setdefault(section, asyncio.Semaphore(self.scan_concurrency))
+        async with slot:
+            await async_request(method, f'{self.plex_url}{key}', params=params, headers={'Accept': 'application/json'}, limiter=self.limiter, raise_errors=self.raise_errors)
+
+
+class AsyncFFConduit(FFConduit, AsyncConduitBase):
+
+    async def api_async(self, method: str, func: callable, *args: tuple) -> dict[str, Any]:
+        data: dict = func.__wrapped__(self, *args)
+        data['apikey'] = self.ff_apikey
+        command = f'{self.PACKAGE}/api/' + '/'.join(func.__name__.split('__'))
+        logger.debug(f'{command}: {data}')
+        match method:
+            case 'POST':
+                return await async_request('POST', f'{self.ff_url}/{command}', data=data, limiter=self.limiter, raise_errors=self.raise_errors)
+            case 'GET':
+                query = urllib.parse.urlencode(data)
+                return await async_request('GET', f'{self.ff_url}/{command}?{query}', limiter=self.limiter, raise_errors=self.raise_errors)
+
+
+class AsyncPlexmateConduit(AsyncFFConduit, PlexmateConduit):
+
+    PACKAGE = 'plex_mate'
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        local_path = event['dest_path'] if event.get('event_type') == 'moved' else event['src_path']
+        remote_path = map_path(local_path, self.mappings) if self.mappings else local_path
+        logger.info(f'{await self.api_async("POST", PlexmateConduit.scan__do_scan, remote_path)}')
+
+
+class AsyncGDSToolConduit(AsyncFFConduit, GDSToolConduit):
+
+    PACKAGE = 'gds_tool'
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        match (event.get('event_type'), event.get('is_directory')):
+            case 'created', _:
+                args = (event.get('src_path'), 'ADD')
+            case 'deleted', True:
+                args = (event.get('src_path'), 'REMOVE_FOLDER')
+            case 'deleted', False:
+                args = (event.get('src_path'), 'REMOVE_FILE')
+            case 'moved', _:
+                args = (event.get('dest_path'), 'ADD')
+            case _:
+                return
+        await self.api_async('GET', GDSToolConduit.fp__broadcast, *args)
+
+
+class AsyncDiscordConduit(DiscordConduit, AsyncConduitBase):
+
+    async def flow(self, event: dict[str, Union[str, bool]]) -> None:
+        '''override'''
+        if self.batcher:
+            return super(AsyncDiscordConduit, self).flow(event)
+        params: dict = DiscordConduit.webhook.__wrapped__(self, embeds=[self.embed(event)])
+        api = params.pop('api')
+        method = params.pop('method')
+        logger.debug(f'{params}')
+        await async_request(method, f'{self.API_URL}{api}', json=params, headers=self.headers, limiter=self.limiter, raise_errors=self.raise_errors)
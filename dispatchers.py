@@ -0,0 +1,557 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import asyncio
+import threading
+import traceback
+import collections
+import concurrent.futures
+from typing import Callable, Coroutine, Union, Optional, Any
+
+try:
+    from utils import close_async_sessions
+    from metrics import METRICS
+except:
+    from .utils import close_async_sessions
+    from .metrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConduitQueue:
+    '''
+    Deliver events to a conduit on its own worker threads
+
+    block: wait until there is room in the queue
+    drop-oldest: discard the oldest pending event
+    coalesce: discard an event identical to a pending one, otherwise wait
+    '''
+
+    POLICIES = ('block', 'drop-oldest', 'coalesce')
+
+    def __init__(self, name: str, target: Callable[[dict], Any],
+                 size: int = 1000,
+                 workers: int = 1,
+                 policy: str = 'block',
+                 interval: Union[int, float] = 0,
+                 stop_timeout: Union[int, float] = 10) -> None:
+        if policy not in self.POLICIES:
+            raise ValueError(f'{policy} not in {self.POLICIES}')
+        self.name = name
+        self.target = target
+        self.size = max(int(size), 1)
+        self.policy = policy
+        self.interval = interval
+        self.stop_timeout = stop_timeout
+        self.stats = {'queued': 0, 'processed': 0, 'failed': 0, 'dropped': 0, 'coalesced': 0, 'max_depth': 0}
+        self._queue: collections.deque = collections.deque()
+        self._pending_keys: collections.Counter = collections.Counter()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._abandoned = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True) for i in range(max(int(workers), 1))
+        ]
+        for thread in self._threads:
+            thread.start()
+        METRICS.gauge('watcher_queue_depth', self._queue.__len__, conduit=name, stage='queue')
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def key(self, event: dict) -> tuple:
+        return event['event_type'], event['is_directory'], event['src_path'], event['dest_path']
+
+    def put(self, event: dict) -> None:
+        with self._condition:
+            if self._closing:
+                logger.warning(f'{self.name}: closed, dropped {event["event_type"]} {event["src_path"]!r}')
+                return
+            key = self.key(event)
+            if self.policy == 'coalesce' and self._pending_keys[key]:
+                self.stats['coalesced'] += 1
+                return
+            if len(self._queue) >= self.size:
+                if self.policy == 'drop-oldest':
+                    dropped = self._queue.popleft()
+                    self._pending_keys[self.key(dropped)] -= 1
+                    self.stats['dropped'] += 1
+                    METRICS.inc('watcher_conduit_dropped_total', conduit=self.name)
+                    logger.warning(f'{self.name}: queue is full, dropped {dropped["event_type"]} {dropped["src_path"]!r}')
+                else:
+                    logger.warning(f'{self.name}: queue is full, waiting... depth={len(self._queue)}')
+                    self._condition.wait_for(lambda: len(self._queue) < self.size or self._closing)
+                    if self._closing:
+                        logger.warning(f'{self.name}: closed, dropped {event["event_type"]} {event["src_path"]!r}')
+                        return
+            self._queue.append(event)
+            self._pending_keys[key] += 1
+            self.stats['queued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._queue))
+            self._condition.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closing)
+                if not self._queue or self._abandoned.is_set():
+                    return
+                event = self._queue.popleft()
+                self._pending_keys[self.key(event)] -= 1
+                self._condition.notify_all()
+            try:
+                self.target(event)
+                result = 'processed'
+            except Exception:
+                result = 'failed'
+                logger.error(traceback.format_exc())
+            with self._condition:
+                self.stats[result] += 1
+            if self.interval:
+                self._abandoned.wait(self.interval)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        deadline = time.time() + self.stop_timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0))
+        self._abandoned.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._queue:
+            logger.warning(f'{self.name}: {len(self._queue)} events were not delivered.')
+        logger.info(f'{self.name}: {self.stats}')
+
+
+class Debouncer:
+    '''
+    Hold events until their path has been quiet for the window and pass on one merged event per path
+
+    created + modified + closed: created
+    created + deleted: nothing
+    created + moved: created at the destination
+    deleted + created: created
+    '''
+
+    RANKS = {'opened': 0, 'closed': 1, 'modified': 2, 'created': 3}
+
+    def __init__(self, name: str, target: Callable[[dict], Any],
+                 window: Union[int, float] = 2,
+                 max_wait: Union[int, float] = 60) -> None:
+        self.name = name
+        self.target = target
+        self.window = window
+        self.max_wait = max_wait
+        self.stats = {'received': 0, 'merged': 0, 'cancelled': 0, 'emitted': 0}
+        # path -> [event, first seen, last seen]
+        self._pending: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._work, name=f'{name}-debounce', daemon=True)
+        self._thread.start()
+        METRICS.gauge('watcher_queue_depth', self._pending.__len__, conduit=name, stage='debounce')
+
+    def put(self, event: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self.stats['received'] += 1
+            if event['event_type'] == 'moved':
+                self._put_moved(event, now)
+                return
+            path = event['src_path']
+            pending = self._pending.get(path)
+            if not pending:
+                self._pending[path] = [dict(event), now, now]
+                return
+            merged = self.merge(pending[0], event)
+            self.stats['merged'] += 1
+            if merged:
+                pending[0] = merged
+                pending[2] = now
+            else:
+                self.stats['cancelled'] += 1
+                del self._pending[path]
+
+    def _put_moved(self, event: dict, now: float) -> None:
+        src, dest = event['src_path'], event['dest_path']
+        pending = self._pending.pop(src, None)
+        first_seen = now
+        if pending:
+            self.stats['merged'] += 1
+            first_seen = pending[1]
+            old = pending[0]
+            if old['event_type'] == 'created':
+                event = {**old, 'src_path': dest, 'dest_path': ''}
+            elif old['event_type'] == 'moved':
+                event = {**event, 'src_path': old['src_path']}
+        key = dest if event['event_type'] == 'moved' else event['src_path']
+        self._pending[key] = [dict(event), first_seen, now]
+
+    def merge(self, old: dict, new: dict) -> Optional[dict]:
+        old_type, new_type = old['event_type'], new['event_type']
+        if new_type == 'deleted':
+            if old_type == 'created':
+                return None
+            if old_type == 'moved':
+                return {**new, 'src_path': old['src_path']}
+            return dict(new)
+        if old_type == 'deleted':
+            return {**new, 'event_type': 'created'} if new_type == 'created' else dict(new)
+        if old_type == 'moved':
+            return old
+        return dict(new) if self.RANKS.get(new_type, 0) >= self.RANKS.get(old_type, 0) else old
+
+    def flush(self, force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            ready = [
+                path for path, (_, first_seen, last_seen) in self._pending.items()
+                if force or now - last_seen >= self.window or now - first_seen >= self.max_wait
+            ]
+            events = [self._pending.pop(path)[0] for path in ready]
+        for event in events:
+            self.stats['emitted'] += 1
+            try:
+                self.target(event)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def _work(self) -> None:
+        while not self._stopped.wait(min(self.window / 2, 1) or 0.1):
+            self.flush()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.flush(force=True)
+        logger.info(f'{self.name}: {self.stats}')
+
+
+class Batcher:
+    '''
+    Collect items by key and pass them on as one list when the window has passed since the first item or the batch is full
+    '''
+
+    def __init__(self, name: str, target: Callable[[list], Any],
+                 window: Union[int, float] = 2,
+                 size: int = 100) -> None:
+        self.name = name
+        self.target = target
+        self.window = window
+        self.size = max(int(size), 1)
+        self.stats = {'received': 0, 'batches': 0, 'items': 0}
+        self._items: dict = {}
+        self._first_seen = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._work, name=f'{name}-batch', daemon=True)
+        self._thread.start()
+        METRICS.gauge('watcher_queue_depth', self._items.__len__, conduit=name, stage='batch')
+
+    def put(self, key: Any, item: Any = None) -> None:
+        with self._condition:
+            self.stats['received'] += 1
+            if not self._items:
+                self._first_seen = time.time()
+            self._items.setdefault(key, key if item is None else item)
+            if len(self._items) >= self.size:
+                self._condition.notify_all()
+
+    def _take(self, force: bool = False) -> list:
+        with self._condition:
+            while not self._stopped and not force:
+                if self._items:
+                    remains = self._first_seen + self.window - time.time()
+                    if remains <= 0 or len(self._items) >= self.size:
+                        break
+                else:
+                    remains = None
+                self._condition.wait(remains)
+            items = list(self._items.values())
+            self._items.clear()
+            return items
+
+    def _flush(self, items: list) -> None:
+        if not items:
+            return
+        for i in range(0, len(items), self.size):
+            batch = items[i:i + self.size]
+            self.stats['batches'] += 1
+            self.stats['items'] += len(batch)
+            try:
+                self.target(batch)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def _work(self) -> None:
+        while not self._stopped:
+            self._flush(self._take())
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._flush(self._take(force=True))
+        logger.info(f'{self.name}: {self.stats}')
+
+
+class AsyncEngine:
+    '''
+    One event loop thread shared by every trick
+
+    Coroutines of async conduits run on the loop and sync conduits run on its thread pool.
+    '''
+
+    _instance: Optional['AsyncEngine'] = None
+    _users = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, workers: int = 16) -> 'AsyncEngine':
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(workers)
+            cls._users += 1
+            return cls._instance
+
+    @classmethod
+    def release(cls) -> None:
+        with cls._lock:
+            cls._users -= 1
+            if cls._users > 0 or cls._instance is None:
+                return
+            instance, cls._instance = cls._instance, None
+        instance.stop()
+
+    def __init__(self, workers: int = 16) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='conduit')
+        self.loop.set_default_executor(self.executor)
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-engine', daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def run_sync(self, func: Callable, *args: Any) -> Any:
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    def stop(self) -> None:
+        try:
+            self.submit(close_async_sessions()).result(10)
+        except Exception:
+            logger.error(traceback.format_exc())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+        self.loop.close()
+
+
+class EventJournal:
+    '''
+    Write-ahead journal of events in SQLite (WAL) with a delivery offset for each conduit
+
+    append() only buffers the event. One thread commits the buffer every commit_interval so that a group of events
+    shares one fsync. Each subscriber reads the journal in order on its own thread and retries a failed delivery
+    with exponential backoff before its offset moves on. Events after the offset are replayed on start.
+    '''
+
+    def __init__(self, path: str,
+                 commit_interval: Union[int, float] = 0.05,
+                 synchronous: str = 'FULL',
+                 read_size: int = 500,
+                 retry_base: Union[int, float] = 1,
+                 retry_max: Union[int, float] = 300,
+                 max_retries: int = 10,
+                 stop_timeout: Union[int, float] = 10) -> None:
+        if synchronous.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f'Unknown synchronous: {synchronous}')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.commit_interval = commit_interval
+        self.read_size = max(int(read_size), 1)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_retries = max_retries
+        self.stop_timeout = stop_timeout
+        self.stats = {'appended': 0, 'commits': 0, 'delivered': 0, 'retried': 0, 'failed': 0, 'replayed': 0}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(f'PRAGMA synchronous={synchronous.upper()}')
+        self._db.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS offsets (conduit TEXT PRIMARY KEY, offset INTEGER NOT NULL)')
+        self._db_lock = threading.Lock()
+        # the last committed id
+        self.last_id = self.get_last_id()
+        self._buffer: list[str] = []
+        self._committing = 0
+        self._offsets: dict[str, int] = {}
+        self._dirty: set[str] = set()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._draining = False
+        self._abandoned = threading.Event()
+        self._readers: list[threading.Thread] = []
+        self._writer = threading.Thread(target=self._write, name='journal-writer', daemon=True)
+        self._writer.start()
+
+    def get_last_id(self) -> int:
+        # ids are never reused with AUTOINCREMENT even after every event is pruned
+        row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+    def append(self, event: dict) -> None:
+        with self._condition:
+            if self._closing:
+                logger.warning(f'Journal is closed, dropped {event["event_type"]} {event["src_path"]!r}')
+                return
+            self._buffer.append(json.dumps(event))
+            self._condition.notify_all()
+
+    def subscribe(self, name: str, target: Callable[[dict], Any], events: Optional[list] = None) -> None:
+        '''deliver the events after the saved offset of this name, a new name starts at the end of the journal'''
+        with self._db_lock:
+            row = self._db.execute('SELECT offset FROM offsets WHERE conduit = ?', (name,)).fetchone()
+            if row is None:
+                offset = self.last_id
+                self._db.execute('INSERT INTO offsets (conduit, offset) VALUES (?, ?)', (name, offset))
+            else:
+                offset = row[0]
+        with self._condition:
+            if name in self._offsets:
+                raise ValueError(f'{name} is already subscribed.')
+            self._offsets[name] = offset
+        METRICS.gauge('watcher_queue_depth', lambda: self.last_id + len(self._buffer) - self._offsets[name], conduit=name, stage='journal')
+        if offset < self.last_id:
+            logger.info(f'{name}: replaying {self.last_id - offset} journaled events')
+            with self._condition:
+                self.stats['replayed'] += self.last_id - offset
+        thread = threading.Thread(target=self._read, args=(name, target, events), name=f'{name}-journal', daemon=True)
+        self._readers.append(thread)
+        thread.start()
+
+    def _write(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._buffer or self._dirty or self._closing)
+                buffer, self._buffer = self._buffer, []
+                offsets = [(self._offsets[name], name) for name in self._dirty]
+                self._dirty.clear()
+                # events of removed conduits are not kept
+                prune = min(self._offsets.values(), default=0)
+                closing = self._closing
+                self._committing = len(buffer)
+            if buffer or offsets:
+                self._commit(buffer, offsets, prune)
+            if closing and not buffer and not offsets:
+                return
+            time.sleep(self.commit_interval)
+
+    def _commit(self, buffer: list[str], offsets: list[tuple], prune: int) -> None:
+        try:
+            with self._db_lock:
+                self._db.execute('BEGIN')
+                try:
+                    self._db.executemany('INSERT INTO events (event) VALUES (?)', ((event,) for event in buffer))
+                    self._db.executemany('UPDATE offsets SET offset = ? WHERE conduit = ?', offsets)
+                    if offsets:
+                        self._db.execute('DELETE FROM events WHERE id <= ?', (prune,))
+                    last_id = self.get_last_id()
+                    self._db.execute('COMMIT')
+                except Exception:
+                    self._db.execute('ROLLBACK')
+                    raise
+        except Exception:
+            logger.error(traceback.format_exc())
+            with self._condition:
+                # try again with the next group
+                self._buffer[:0] = buffer
+                self._dirty.update(name for _, name in offsets)
+                self._committing = 0
+                self._condition.notify_all()
+            return
+        with self._condition:
+            self._committing = 0
+            self.last_id = max(self.last_id, last_id)
+            self.stats['appended'] += len(buffer)
+            self.stats['commits'] += 1
+            self._condition.notify_all()
+
+    def _read(self, name: str, target: Callable[[dict], Any], events: Optional[list]) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.last_id > self._offsets[name] or self._draining)
+                if self._abandoned.is_set() or (self._draining and self.last_id <= self._offsets[name]):
+                    return
+                offset = self._offsets[name]
+            with self._db_lock:
+                rows = self._db.execute(
+                    'SELECT id, event FROM events WHERE id > ? ORDER BY id LIMIT ?', (offset, self.read_size)
+                ).fetchall()
+            for id_, text in rows:
+                event = json.loads(text)
+                if events is None or event['event_type'] in events:
+                    if not self._deliver(name, target, event):
+                        # keep the offset, the event will be replayed on the next start
+                        return
+                with self._condition:
+                    self._offsets[name] = id_
+                    self._dirty.add(name)
+                    self._condition.notify_all()
+
+    def _deliver(self, name: str, target: Callable[[dict], Any], event: dict) -> bool:
+        attempt = 0
+        while True:
+            if self._abandoned.is_set():
+                return False
+            try:
+                target(event)
+                with self._condition:
+                    self.stats['delivered'] += 1
+                return True
+            except Exception:
+                logger.error(traceback.format_exc())
+            attempt += 1
+            if self.max_retries and attempt > self.max_retries:
+                with self._condition:
+                    self.stats['failed'] += 1
+                logger.error(f'{name}: gave up {event["event_type"]} {event["src_path"]!r} after {self.max_retries} retries')
+                return True
+            delay = min(self.retry_base * 2 ** (attempt - 1), self.retry_max)
+            with self._condition:
+                self.stats['retried'] += 1
+            METRICS.inc('watcher_conduit_retries_total', conduit=name)
+            logger.warning(f'{name}: retry #{attempt} in {delay}s: {event["event_type"]} {event["src_path"]!r}')
+            if self._abandoned.wait(delay):
+                return False
+
+    def stop(self) -> None:
+        # commit the buffer, let the subscribers catch up until the timeout and save their offsets
+        deadline = time.time() + self.stop_timeout
+        with self._condition:
+            self._condition.wait_for(lambda: not self._buffer and not self._committing, max(deadline - time.time(), 0))
+            self._draining = True
+            self._condition.notify_all()
+        for thread in self._readers:
+            thread.join(max(deadline - time.time(), 0))
+        self._abandoned.set()
+        # a reader still inside its target advances its offset when it returns, the writer has to see it
+        for thread in self._readers:
+            thread.join()
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._writer.join()
+        with self._db_lock:
+            pending = self._db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            self._db.close()
+        if pending:
+            logger.warning(f'{pending} journaled events are kept for the next start: {self.path!r}')
+        logger.info(f'journal: {self.stats}')
@@ -0,0 +1,294 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import functools
+import contextlib
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Iterable, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTIONS = {
+    'watcher_snapshot_seconds': 'Duration of a polling walk',
+    'watcher_snapshot_entries': 'Entries of the last polling walk',
+    'watcher_snapshot_entries_per_second': 'Entries per second of the last polling walk',
+    'watcher_diff_seconds': 'Duration of a snapshot diff',
+    'watcher_events_total': 'Events matched by a trick',
+    'watcher_async_pending': 'Events handed to the event loop and not delivered yet',
+    'watcher_conduit_flow_seconds': 'Duration of a delivery to a conduit',
+    'watcher_conduit_errors_total': 'Deliveries that raised an exception',
+    'watcher_conduit_retries_total': 'Deliveries retried by the journal',
+    'watcher_conduit_dropped_total': 'Events dropped by a full queue',
+    'watcher_queue_depth': 'Events waiting in a stage of a conduit',
+    'watcher_conduit_limited_total': 'Responses of a rate limit such as 429',
+    'watcher_conduit_throttled_seconds_total': 'Seconds spent waiting for the rate limit of a conduit',
+    'watcher_rclone_refresh_seconds': 'Duration of a vfs/refresh call',
+    'watcher_http_errors_total': 'HTTP requests that failed or returned an error status',
+}
+
+
+class Histogram:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        # the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: Union[int, float]) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timer:
+
+    __slots__ = ('registry', 'name', 'errors', 'labels', 'start')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, errors: Optional[str], labels: dict) -> None:
+        self.registry = registry
+        self.name = name
+        self.errors = errors
+        self.labels = labels
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type and self.errors:
+            self.registry.inc(self.errors, **self.labels)
+
+
+class MetricsRegistry:
+    '''
+    Counters, gauges and histograms in the Prometheus text format
+
+    Every call returns at once while disabled so that the hot paths can call them unconditionally.
+    '''
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    NULL_TIMER = contextlib.nullcontext()
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.buckets = self.BUCKETS
+        # name -> counter | gauge | histogram
+        self._types: dict[str, str] = {}
+        # name -> labels -> value or Histogram
+        self._values: dict[str, dict[tuple, Any]] = {}
+        # name -> labels -> callable returning the value
+        self._callbacks: dict[str, dict[tuple, Callable[[], Any]]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._threads: list[threading.Thread] = []
+        self._stopped = threading.Event()
+        self.file = None
+
+    def configure(self, enabled: bool = True,
+                  host: str = '127.0.0.1',
+                  port: int = 0,
+                  file: Optional[str] = None,
+                  interval: Union[int, float] = 60,
+                  buckets: Optional[Iterable[float]] = None) -> None:
+        '''port: serve /metrics over HTTP, file: write the metrics every interval'''
+        self.stop()
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets)) if buckets else self.BUCKETS
+        self.file = file
+        if not enabled:
+            return
+        self._stopped.clear()
+        if port:
+            self.serve(host, port)
+        if file:
+            thread = threading.Thread(target=self._dump_periodically, args=(interval,), name='metrics-dump', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        logger.info(f'Metrics: port={port} file={file!r}')
+
+    def _series(self, name: str, kind: str) -> dict[tuple, Any]:
+        self._types.setdefault(name, kind)
+        return self._values.setdefault(name, {})
+
+    def inc(self, name: str, value: Union[int, float] = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(labels.items())
+        with self._lock:
+            series = self._series(name, 'counter')
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: Union[int, float], **labels: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._series(name, 'gauge')[tuple(labels.items())] = value
+
+    def gauge(self, name: str, func: Callable[[], Union[int, float]], **labels: str) -> None:
+        '''read the value from func on every render, it must not take a lock'''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._types.setdefault(name, 'gauge')
+            self._callbacks.setdefault(name, {})[tuple(labels.items())] = func
+
+    def observe(self, name: str, value: Union[int, float], **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(labels.items())
+        with self._lock:
+            series = self._series(name, 'histogram')
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timer(self, name: str, errors: Optional[str] = None, **labels: str) -> Union[Timer, contextlib.nullcontext]:
+        '''observe the duration of a with block and count its exceptions in errors'''
+        if not self.enabled:
+            return self.NULL_TIMER
+        return Timer(self, name, errors, labels)
+
+    def timed(self, func: Callable, name: str, errors: Optional[str] = None, **labels: str) -> Callable:
+        if not self.enabled:
+            return func
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwds: Any) -> Any:
+            with Timer(self, name, errors, labels):
+                return func(*args, **kwds)
+        return wrapper
+
+    def get(self, name: str, **labels: str) -> Any:
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(labels.items()))
+
+    def quantile(self, name: str, q: float, **labels: str) -> Optional[float]:
+        '''estimate a quantile of a histogram by linear interpolation in its bucket like histogram_quantile()'''
+        histogram = self.get(name, **labels)
+        if not histogram or not histogram.count:
+            return None
+        rank = q * histogram.count
+        cumulative = 0
+        for index, count in enumerate(histogram.counts):
+            if cumulative + count >= rank and count:
+                if index == len(histogram.buckets):
+                    # +Inf, the upper bound is unknown
+                    return histogram.buckets[-1]
+                lower = histogram.buckets[index - 1] if index else 0
+                return lower + (histogram.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return histogram.buckets[-1]
+
+    @staticmethod
+    def format_labels(labels: Iterable[tuple], *extra: tuple) -> str:
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        escaped = (
+            (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs
+        )
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def render(self) -> str:
+        with self._lock:
+            types = dict(self._types)
+            values = {}
+            for name, series in self._values.items():
+                values[name] = {
+                    key: (list(value.counts), value.sum, value.count) if isinstance(value, Histogram) else value
+                    for key, value in series.items()
+                }
+            callbacks = {name: dict(series) for name, series in self._callbacks.items()}
+        # outside the lock, the callbacks may be slow
+        for name, series in callbacks.items():
+            target = values.setdefault(name, {})
+            for key, func in series.items():
+                try:
+                    target[key] = func()
+                except Exception:
+                    logger.error(traceback.format_exc())
+        lines = []
+        for name in sorted(values):
+            kind = types[name]
+            if name in DESCRIPTIONS:
+                lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in values[name].items():
+                if kind == 'histogram':
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                        cumulative += bucket
+                        lines.append(f'{name}_bucket{self.format_labels(key, ("le", bound))} {cumulative}')
+                    lines.append(f'{name}_sum{self.format_labels(key)} {total}')
+                    lines.append(f'{name}_count{self.format_labels(key)} {count}')
+                else:
+                    lines.append(f'{name}{self.format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host: str, port: int) -> None:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def dump(self, file: Optional[str] = None) -> None:
+        '''write the metrics at once so that a reader never sees a partial file'''
+        file = file or self.file
+        if not file:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+            temp = f'{file}.tmp'
+            with open(temp, 'w') as output:
+                output.write(self.render())
+            os.replace(temp, file)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def _dump_periodically(self, interval: Union[int, float]) -> None:
+        while not self._stopped.wait(interval):
+            self.dump()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        if self.enabled and self.file:
+            self.dump()
+
+
+METRICS = MetricsRegistry()
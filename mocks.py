@@ -0,0 +1,293 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+import collections
+import urllib.parse
+from stat import S_ISDIR
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+class MockServer:
+    '''
+    A local stand-in of an API for load tests
+
+    latency: seconds or [min, max] added to every response
+    error_rate: share of the requests answered with 500
+    rate_limit: requests per second over which 429 is answered with Retry-After, burst is the bucket size
+    '''
+
+    NAME = 'mock'
+
+    def __init__(self, host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: Union[int, float, list] = 0,
+                 error_rate: float = 0,
+                 rate_limit: Union[int, float] = 0,
+                 burst: Optional[int] = None,
+                 seed: Optional[int] = None) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst or max(math.ceil(rate_limit), 1)
+        self.random = random.Random(seed)
+        self.stats = collections.Counter()
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def handle(self, method: str, path: str, params: dict[str, Any]) -> tuple[int, Any]:
+        '''return the status and the body of a request, None is an empty body'''
+        return 404, {'error': f'Unknown path: {path}'}
+
+    def take_token(self) -> float:
+        '''0 if the request is allowed, otherwise the seconds until the next token'''
+        if not self.rate_limit:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._refilled_at) * self.rate_limit, self.burst)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate_limit
+
+    def sample_latency(self) -> float:
+        if isinstance(self.latency, (list, tuple)):
+            with self._lock:
+                return self.random.uniform(*self.latency)
+        return self.latency
+
+    def respond(self, method: str, path: str, params: dict[str, Any]) -> tuple[int, dict, Any]:
+        with self._lock:
+            self.stats['requests'] += 1
+        wait = self.take_token()
+        if wait:
+            with self._lock:
+                self.stats['limited'] += 1
+            return 429, {'Retry-After': str(math.ceil(wait))}, {'error': 'rate limited', 'status': 429}
+        latency = self.sample_latency()
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if failed:
+            with self._lock:
+                self.stats['errors'] += 1
+            return 500, {}, {'error': 'mock error', 'status': 500}
+        status, body = self.handle(method, path, params)
+        with self._lock:
+            self.stats[f'{status} {path}'] += 1
+        return status, {}, body
+
+    def start(self) -> 'MockServer':
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+            # the headers and the body are sent apart, do not wait for the delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                self.dispatch('GET')
+
+            def do_POST(self) -> None:
+                self.dispatch('POST')
+
+            def dispatch(self, method: str) -> None:
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        params.update(json.loads(body or '{}'))
+                    else:
+                        params.update(urllib.parse.parse_qsl(body))
+                status, headers, body = mock.respond(method, url.path, params)
+                content = b'' if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(f'{mock.NAME}: {format % args}')
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'{self.NAME}-mock', daemon=True)
+        self._thread.start()
+        logger.info(f'{self.NAME}: {self.url}')
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+        logger.info(f'{self.NAME}: {dict(self.stats)}')
+
+
+class MockRclone(MockServer):
+    '''
+    vfs/refresh and vfs/stats of rclone rc on the local folder root
+
+    A directory is in the vfs if it was there on start or its parent has been refreshed since it was created.
+    Otherwise vfs/refresh answers 'file does not exist' like rclone does for a folder it has not listed yet.
+    The folders under root are listed once on start.
+    '''
+
+    NAME = 'rclone'
+
+    def __init__(self, *args, root: str = '/', **kwds) -> None:
+        super(MockRclone, self).__init__(*args, **kwds)
+        self.root = root
+        # remote directories listed into the vfs
+        self.known: set[str] = set()
+        self.files = 0
+        self.list_dir('', True)
+
+    def local_path(self, remote_path: str) -> str:
+        return os.path.join(self.root, remote_path.strip('/'))
+
+    def is_cached(self, remote_path: str) -> bool:
+        remote_path = remote_path.strip('/')
+        try:
+            st = os.stat(self.local_path(remote_path))
+        except OSError:
+            return False
+        if not S_ISDIR(st.st_mode):
+            return False
+        return not remote_path or remote_path in self.known
+
+    def list_dir(self, remote_path: str, recursive: bool) -> None:
+        pending = [remote_path.strip('/')]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(self.local_path(current)) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            child = f'{current}/{entry.name}' if current else entry.name
+                            with self._lock:
+                                self.known.add(child)
+                            if recursive:
+                                pending.append(child)
+                        else:
+                            with self._lock:
+                                self.files += 1
+            except OSError:
+                continue
+
+    def handle(self, method: str, path: str, params: dict[str, Any]) -> tuple[int, Any]:
+        '''override'''
+        match path.strip('/'):
+            case 'vfs/refresh':
+                recursive = str(params.get('recursive', 'false')).lower() == 'true'
+                dirs = [value for key, value in params.items() if key == 'dir' or (key.startswith('dir') and key[3:].isdigit())]
+                result = {}
+                for remote_path in dirs or ['']:
+                    if self.is_cached(remote_path):
+                        self.list_dir(remote_path, recursive)
+                        result[remote_path] = 'OK'
+                    else:
+                        result[remote_path] = 'file does not exist'
+                return 200, {'result': result}
+            case 'vfs/stats':
+                with self._lock:
+                    dirs, files = len(self.known), self.files
+                return 200, {'fs': params.get('fs', ''), 'metadataCache': {'dirs': dirs, 'files': files}}
+        return super(MockRclone, self).handle(method, path, params)
+
+
+class MockPlex(MockServer):
+    '''
+    /library/sections and /library/sections/{key}/refresh of Plex
+
+    sections: [{'key': 1, 'title': 'Movies', 'locations': ['/mnt/gds/movies']}]
+    '''
+
+    NAME = 'plex'
+
+    def __init__(self, *args, sections: Optional[list[dict]] = None, token: Optional[str] = None, **kwds) -> None:
+        super(MockPlex, self).__init__(*args, **kwds)
+        self.sections = {int(section['key']): section for section in sections or []}
+        self.token = token
+
+    def handle(self, method: str, path: str, params: dict[str, Any]) -> tuple[int, Any]:
+        '''override'''
+        if self.token and not params.get('X-Plex-Token') == self.token:
+            return 401, None
+        parts = path.strip('/').split('/')
+        if parts == ['library', 'sections']:
+            return 200, {'MediaContainer': {'size': len(self.sections), 'Directory': [
+                {
+                    'key': str(key),
+                    'title': section.get('title', str(key)),
+                    'Location': [{'id': index, 'path': location} for index, location in enumerate(section.get('locations') or [])],
+                } for key, section in self.sections.items()
+            ]}}
+        if len(parts) == 4 and parts[:2] == ['library', 'sections'] and parts[3] == 'refresh':
+            if not parts[2].isdigit() or int(parts[2]) not in self.sections:
+                return 404, None
+            return 200, None
+        return super(MockPlex, self).handle(method, path, params)
+
+
+class MockFF(MockServer):
+    '''scan/do_scan of plex_mate and fp/broadcast of gds_tool'''
+
+    NAME = 'ff'
+    COMMANDS = ('plex_mate/api/scan/do_scan', 'gds_tool/api/fp/broadcast')
+
+    def __init__(self, *args, apikey: Optional[str] = None, **kwds) -> None:
+        super(MockFF, self).__init__(*args, **kwds)
+        self.apikey = apikey
+
+    def handle(self, method: str, path: str, params: dict[str, Any]) -> tuple[int, Any]:
+        '''override'''
+        if path.strip('/') not in self.COMMANDS:
+            return super(MockFF, self).handle(method, path, params)
+        if self.apikey and not params.get('apikey') == self.apikey:
+            return 200, {'ret': 'error', 'msg': 'apikey'}
+        return 200, {'ret': 'success', 'msg': f'{path}: {params.get("target") or params.get("gds_path")}'}
+
+
+MOCKS = {
+    'rclone': MockRclone,
+    'plex': MockPlex,
+    'ff': MockFF,
+}
+
+
+def start_mocks(config: dict[str, dict]) -> list[MockServer]:
+    '''config: {'rclone': {'port': 5572, 'latency': [0.05, 0.2]}, 'plex': {...}, 'ff': {...}}'''
+    mocks = []
+    for name, options in config.items():
+        if name not in MOCKS:
+            raise ValueError(f'{name} not in {tuple(MOCKS)}')
+        mocks.append(MOCKS[name](**(options or {})).start())
+    return mocks
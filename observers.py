@@ -1,15 +1,37 @@
 import os
+import time
+import fnmatch
+import hashlib
 import threading
+import functools
 import logging
+import traceback
+import collections
+from stat import S_ISDIR
+from typing import Optional, Iterable, Tuple, Any
 
 from watchdog.observers.api import BaseObserver, DEFAULT_OBSERVER_TIMEOUT, DEFAULT_EMITTER_TIMEOUT
 from watchdog.observers.polling import PollingEmitter
-from watchdog.utils.dirsnapshot import DirectorySnapshot, EmptyDirectorySnapshot
+from watchdog.utils.dirsnapshot import DirectorySnapshot, DirectorySnapshotDiff, EmptyDirectorySnapshot
+from watchdog.events import (
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirModifiedEvent,
+    DirMovedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
 
 try:
-    from utils import SimpleDirectorySnapShot
+    from utils import SimpleDirectorySnapShot, StoredDirectorySnapShot, PathMatcher, read_mounts, get_fstype
+    from snapshots import ColumnarSnapshot, CompactSnapshot, ColumnarSnapshotDiff, PathSnapshotDiff
+    from metrics import METRICS
 except:
-    from .utils import SimpleDirectorySnapShot
+    from .utils import SimpleDirectorySnapShot, StoredDirectorySnapShot, PathMatcher, read_mounts, get_fstype
+    from .snapshots import ColumnarSnapshot, CompactSnapshot, ColumnarSnapshotDiff
+    from .metrics import METRICS
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +39,23 @@ logger = logging.getLogger(__name__)
 
 class SimplePollingEmitter(PollingEmitter):
 
+    # share key -> emitters, the first one is the leader
+    _groups: dict[tuple, list['SimplePollingEmitter']] = {}
+    _groups_lock = threading.Lock()
+
+    # name: (snapshot class, diff class)
+    DIFF_ENGINES = {
+        'watchdog': (SimpleDirectorySnapShot, DirectorySnapshotDiff),
+        # columns sorted by path compared in one merge pass
+        'merge': (ColumnarSnapshot, lambda ref, snapshot: ColumnarSnapshotDiff(
+            ColumnarSnapshot.from_snapshot(ref), ColumnarSnapshot.from_snapshot(snapshot)
+        )),
+        # the merge engine with the paths of directories shared among their entries
+        'compact': (CompactSnapshot, lambda ref, snapshot: ColumnarSnapshotDiff(
+            CompactSnapshot.from_snapshot(ref), CompactSnapshot.from_snapshot(snapshot)
+        )),
+    }
+
     def __init__(
         self,
         event_queue,
@@ -25,25 +64,564 @@ class SimplePollingEmitter(PollingEmitter):
         event_filter=None,
         stat=os.stat,
         listdir=os.scandir,
+        snapshot_dir: Optional[str] = None,
+        snapshot_interval: int = 600,
+        incremental: bool = False,
+        use_direntry: bool = False,
+        walk_workers: int = 1,
+        prune_patterns: Optional[list] = None,
+        prune_ignored: bool = False,
+        diff_engine: str = 'watchdog',
+        shared: bool = True,
     ):
         super(SimplePollingEmitter, self).__init__(event_queue, watch, timeout, event_filter)
+        # emitters of other observers with the same folder and options share the walk of the first one started
+        self.share_key = (
+            type(self), os.path.abspath(watch.path), watch.is_recursive, timeout, stat, listdir, snapshot_dir, snapshot_interval,
+            incremental, use_direntry, walk_workers, tuple(prune_patterns or ()), prune_ignored, diff_engine,
+        ) if shared else None
+        self.leader: Optional['SimplePollingEmitter'] = None
+        if diff_engine not in self.DIFF_ENGINES:
+            raise ValueError(f'{diff_engine} not in {tuple(self.DIFF_ENGINES)}')
+        self.snapshot_class, diff = self.DIFF_ENGINES[diff_engine]
+        self.diff = METRICS.timed(diff, 'watcher_diff_seconds', watch=watch.path)
+        self.path_diff = METRICS.timed(PathSnapshotDiff, 'watcher_diff_seconds', watch=watch.path)
         self._snapshot: DirectorySnapshot = EmptyDirectorySnapshot()
-        self._lock = threading.Lock()
-        self._take_snapshot = lambda: SimpleDirectorySnapShot(
-            self.watch.path, self.watch.is_recursive, stat=stat, listdir=listdir, stopped_event=self.stopped_event
-        )
+        self._lock = threading.RLock()
+        self.incremental = incremental
+        self._snapshot_options = {'stat': stat, 'listdir': listdir, 'use_direntry': use_direntry, 'walk_workers': walk_workers}
+        self._take_snapshot = lambda: self.take_snapshot(self.watch.path, self.watch.is_recursive, self._snapshot)
+        self.prune_matcher = PathMatcher(None, prune_patterns) if prune_patterns else None
+        # skip what every handler of this watch ignores
+        self.prune_ignored = prune_ignored
+        self.handler_matchers: list[PathMatcher] = []
+        self.snapshot_file = None
+        if snapshot_dir:
+            key = hashlib.md5(f'{os.path.abspath(self.watch.path)}:{self.watch.is_recursive}'.encode()).hexdigest()
+            self.snapshot_file = os.path.join(snapshot_dir, f'{key}.snapshot')
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_saved_at = time.time()
+
+    @classmethod
+    def join_group(cls, emitter: 'SimplePollingEmitter') -> 'SimplePollingEmitter':
+        with cls._groups_lock:
+            members = cls._groups.setdefault(emitter.share_key, [])
+            members.append(emitter)
+            return members[0]
+
+    @classmethod
+    def leave_group(cls, emitter: 'SimplePollingEmitter') -> None:
+        with cls._groups_lock:
+            members = cls._groups.get(emitter.share_key, [])
+            if emitter in members:
+                members.remove(emitter)
+            if not members:
+                cls._groups.pop(emitter.share_key, None)
+                return
+            if not emitter.leader is emitter:
+                return
+            # hand over the snapshot to the next one
+            successor = members[0]
+            with emitter._lock, successor._lock:
+                successor.take_over(emitter)
+                for member in members:
+                    member.leader = successor
+        logger.info(f'Took over the polling: {successor.watch.path!r}')
+
+    def take_over(self, leader: 'SimplePollingEmitter') -> None:
+        self._snapshot = leader._snapshot
+
+    def followers(self) -> list['SimplePollingEmitter']:
+        if not self.share_key or not self.leader is self:
+            return []
+        return self._groups.get(self.share_key, [])[1:]
+
+    @property
+    def is_follower(self) -> bool:
+        return self.leader is not None and self.leader is not self
+
+    def queue_event(self, event) -> None:
+        '''override: the leader queues its events for the followers too'''
+        super(SimplePollingEmitter, self).queue_event(event)
+        for follower in self.followers():
+            PollingEmitter.queue_event(follower, event)
 
     def on_thread_start(self) -> None:
-        logger.info(f'Take first snapshot: {self.watch.path!r}')
-        self._snapshot = self._take_snapshot()
-        logger.info(f'{len(self._snapshot._stat_info)} directories and files: {self.watch.path!r}')
+        if self.is_follower:
+            logger.info(f'Sharing the snapshot of another observer: {self.watch.path!r}')
+            return
+        self._snapshot = self.load_snapshot()
+        if self._snapshot is None:
+            logger.info(f'Take first snapshot: {self.watch.path!r}')
+            self._snapshot = self._take_snapshot()
+            self.save_snapshot()
+        logger.info(f'{len(self._snapshot._stat_info)} directories and files, {getattr(self._snapshot, "pruned", 0)} pruned: {self.watch.path!r}')
+        if hasattr(self._snapshot, 'nbytes') and self._snapshot._stat_info:
+            logger.debug(f'{self._snapshot.nbytes() / len(self._snapshot._stat_info):.1f} bytes per entry: {self.watch.path!r}')
+
+    def take_snapshot(self, path: str, recursive: bool, previous: Optional[DirectorySnapshot] = None,
+                      options: Optional[dict] = None) -> DirectorySnapshot:
+        '''options: replace some of the snapshot options such as stat and listdir'''
+        pruning = bool(self.prune_matcher or self.prune_ignored)
+        start = time.perf_counter()
+        snapshot = self.snapshot_class(
+            path, recursive, stopped_event=self.stopped_event,
+            previous=previous if self.incremental and getattr(previous, 'completed', False) else None,
+            prune=self.prunes if pruning else None,
+            prune_below=self.prunes_below if pruning else None,
+            **({**self._snapshot_options, **options} if options else self._snapshot_options),
+        )
+        if METRICS.enabled and snapshot.completed:
+            elapsed = time.perf_counter() - start
+            entries = len(snapshot._stat_info)
+            METRICS.observe('watcher_snapshot_seconds', elapsed, watch=self.watch.path)
+            METRICS.set('watcher_snapshot_entries', entries, watch=self.watch.path)
+            METRICS.set('watcher_snapshot_entries_per_second', round(entries / elapsed) if elapsed else 0, watch=self.watch.path)
+        return snapshot
+
+    def group_matchers(self) -> list[PathMatcher]:
+        '''the matchers of the handlers of every emitter sharing this walk'''
+        members = self._groups.get(self.share_key, [self]) if self.share_key else [self]
+        if not all(member.handler_matchers for member in members):
+            return []
+        return [matcher for member in members for matcher in member.handler_matchers]
+
+    def prunes(self, path: str) -> bool:
+        # a folder whose name matches an ignore pattern like "*.tmp" may hold paths the handlers still want
+        return bool(self.prune_matcher and self.prune_matcher.ignores(path))
+
+    def prunes_below(self, path: str) -> bool:
+        if self.prune_matcher and self.prune_matcher.ignores_below(path):
+            return True
+        if not self.prune_ignored:
+            return False
+        matchers = self.group_matchers()
+        return bool(matchers) and all(m.ignores_below(path) for m in matchers)
 
     def on_thread_stop(self) -> None:
-        pass
+        with self._lock:
+            self.save_snapshot()
+        if self.share_key:
+            self.leave_group(self)
+
+    def queue_events(self, timeout: int) -> None:
+        # timeout behaves like an interval for polling emitters.
+        if self.stopped_event.wait(timeout) or self.is_follower:
+            return
+
+        with self._lock:
+            if not self.should_keep_running():
+                return
+            try:
+                new_snapshot = self._take_snapshot()
+            except OSError:
+                self.queue_event(DirDeletedEvent(self.watch.path))
+                self.stop()
+                return
+            # do not compare with a snapshot cut off by stop()
+            if not new_snapshot.completed:
+                return
+            if new_snapshot.incremental:
+                logger.debug(f'listed={new_snapshot.listed} carried={new_snapshot.carried}: {self.watch.path!r}')
+            events = self.diff_with(self._snapshot, new_snapshot)
+            self._snapshot = new_snapshot
+            self.queue_diff(events)
+
+            if time.time() - self._snapshot_saved_at > self.snapshot_interval:
+                self.save_snapshot()
+
+    def diff_with(self, ref: DirectorySnapshot, snapshot: DirectorySnapshot) -> DirectorySnapshotDiff:
+        # the inode and device numbers of a saved snapshot may not match the mount any more
+        diff = self.path_diff if getattr(ref, 'stored', False) else self.diff
+        return diff(ref, snapshot)
+
+    def queue_diff(self, events: DirectorySnapshotDiff, exclude: Optional[str] = None) -> int:
+        '''queue the events of a diff except the ones of the path exclude and return how many were queued'''
+        queued = 0
+        for event_class, paths in (
+            (FileDeletedEvent, events.files_deleted),
+            (FileModifiedEvent, events.files_modified),
+            (FileCreatedEvent, events.files_created),
+            (FileMovedEvent, events.files_moved),
+            (DirDeletedEvent, events.dirs_deleted),
+            (DirModifiedEvent, events.dirs_modified),
+            (DirCreatedEvent, events.dirs_created),
+            (DirMovedEvent, events.dirs_moved),
+        ):
+            for path in paths:
+                args = path if isinstance(path, tuple) else (path,)
+                if exclude in args:
+                    continue
+                self.queue_event(event_class(*args))
+                queued += 1
+        return queued
+
+    def load_snapshot(self) -> Optional[DirectorySnapshot]:
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return
+        try:
+            snapshot = StoredDirectorySnapShot(self.snapshot_file)
+        except Exception:
+            logger.error(traceback.format_exc())
+            return
+        if not snapshot.root == self.watch.path or not snapshot.recursive == self.watch.is_recursive:
+            logger.warning(f'The saved snapshot is for {snapshot.root!r}: {self.snapshot_file!r}')
+            return
+        logger.info(f'Loaded snapshot: {self.snapshot_file!r}')
+        return snapshot
+
+    def save_snapshot(self) -> None:
+        if not self.snapshot_file or not getattr(self._snapshot, 'completed', False):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+            count = StoredDirectorySnapShot.dump(self._snapshot, self.snapshot_file, self.watch.path, self.watch.is_recursive)
+            self._snapshot_saved_at = time.time()
+            logger.debug(f'Saved snapshot: {count} entries to {self.snapshot_file!r}')
+        except Exception:
+            logger.error(traceback.format_exc())
+
+
+class DictSnapshot(DirectorySnapshot):
+    '''a snapshot of the given entries'''
+
+    def __init__(self, entries: Iterable[Tuple[str, Any]] = (), taken_at: float = 0, stored: bool = False) -> None:
+        self.completed = True
+        self.taken_at = taken_at
+        # entries of a saved snapshot
+        self.stored = stored
+        self._stat_info = {}
+        self._inode_to_path = {}
+        for path, st in entries:
+            self._stat_info[path] = st
+            self._inode_to_path[(st.st_ino, st.st_dev)] = path
+
+
+class CombinedSnapshot(DirectorySnapshot):
+    '''one view of several snapshots to save them as one'''
+
+    def __init__(self, snapshots: Iterable[DirectorySnapshot]) -> None:
+        snapshots = [snapshot for snapshot in snapshots if hasattr(snapshot, '_stat_info')]
+        self.completed = all(getattr(snapshot, 'completed', True) for snapshot in snapshots)
+        self.taken_at = min((getattr(snapshot, 'taken_at', 0) for snapshot in snapshots), default=0)
+        self._stat_info = collections.ChainMap(*(snapshot._stat_info for snapshot in snapshots))
+
+
+class StatThrottle:
+    '''a token bucket of stats per second around stat() and listdir() of a walk, shared by its walker threads'''
+
+    def __init__(self, rate: int, stat, listdir, use_direntry: bool, stopped_event: threading.Event) -> None:
+        self.rate = rate
+        self._stat = stat
+        self._listdir = listdir
+        # stat() of a DirEntry is not injected, so its entries are counted instead
+        self.use_direntry = use_direntry
+        self.stopped_event = stopped_event
+        self._tokens = float(rate)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._refilled_at) * self.rate, self.rate) - 1
+            self._refilled_at = now
+            # a negative balance is paid back by waiting, so concurrent walkers keep the rate together
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self.stopped_event.wait(wait)
+
+    def stat(self, path: str) -> os.stat_result:
+        self.take()
+        return self._stat(path)
+
+    def listdir(self, path: str) -> Iterable[os.DirEntry]:
+        self.take()
+        entries = self._listdir(path)
+        return self.counted(entries) if self.use_direntry else entries
+
+    def counted(self, entries: Iterable[os.DirEntry]) -> Iterable[os.DirEntry]:
+        for entry in entries:
+            self.take()
+            yield entry
+
+
+class Shard:
+    '''
+    A folder polled on its own schedule
+
+    A shard is walked recursively unless it is split. A split shard lists only its own folder and each of its subfolders
+    is a shard of its own.
+    '''
+
+    def __init__(self, path: str, snapshot: DirectorySnapshot, due: int = 0, split: bool = False) -> None:
+        self.path = path
+        self.snapshot = snapshot
+        self.split = split
+        self.interval = 1
+        self.due = due
+        self.cost = len(getattr(snapshot, '_stat_info', ()))
+
+    def polled(self, tick: int, changed: bool, max_interval: int) -> None:
+        # a shard with changes is polled on every tick and a quiet one less and less often
+        self.interval = 1 if changed else min(self.interval * 2, max_interval)
+        self.due = tick + self.interval
+        self.cost = len(self.snapshot._stat_info)
+
+
+class ShardedPollingEmitter(SimplePollingEmitter):
+    '''
+    Poll a recursive watch by shards: the watched folder without its subfolders and each of the subfolders
+
+    A shard of more than shard_max_entries entries is split into its folder and its subfolders, and so on.
+    On every tick the watched folder is polled and then the shards that are due, oldest first,
+    until the stat budget of the tick (stats_per_second * timeout) is spent.
+    The walks are paced by a token bucket of stats_per_second and do not hold the lock of the emitter.
+    Moves between shards are reported as deleted and created except moves of whole shards within their folder.
+    '''
+
+    def __init__(self, *args, shard_stats_per_second: int = 0, shard_max_interval: int = 8,
+                 shard_max_entries: int = 10000, **kwds) -> None:
+        super(ShardedPollingEmitter, self).__init__(*args, **kwds)
+        self.stats_per_second = shard_stats_per_second
+        self.max_interval = max(int(shard_max_interval), 1)
+        self.budget = self.stats_per_second * self.timeout if self.stats_per_second else 0
+        # a shard fits in the budget of a tick
+        self.max_entries = max(min(int(shard_max_entries), self.budget) if self.budget else int(shard_max_entries), 1)
+        if self.share_key:
+            self.share_key += (shard_stats_per_second, shard_max_interval, shard_max_entries)
+        self.throttle = StatThrottle(
+            self.stats_per_second, self._snapshot_options['stat'], self._snapshot_options['listdir'],
+            self._snapshot_options['use_direntry'], self.stopped_event,
+        ) if self.stats_per_second else None
+        self._walk_options = {'stat': self.throttle.stat, 'listdir': self.throttle.listdir} if self.throttle else None
+        # path -> shard, the watched folder is a split shard polled on every tick
+        self._shards: dict[str, Shard] = {}
+        self._tick = 0
+
+    def on_thread_start(self) -> None:
+        '''override'''
+        if not self.watch.is_recursive or self.is_follower:
+            return super(ShardedPollingEmitter, self).on_thread_start()
+        snapshot = loaded = self.load_snapshot()
+        if loaded is None:
+            # the first walk is not throttled, nothing can be reported before it
+            logger.info(f'Take first snapshot: {self.watch.path!r}')
+            snapshot = self.take_snapshot(self.watch.path, True)
+        root = Shard(self.watch.path, snapshot)
+        self._shards[root.path] = root
+        self.split_shard(root)
+        self._snapshot = CombinedSnapshot(shard.snapshot for shard in self._shards.values())
+        if loaded is None:
+            self.save_snapshot()
+        logger.info(f'{len(self._snapshot._stat_info)} directories and files in {len(self._shards)} shards: {self.watch.path!r}')
+
+    def subfolders(self, snapshot: DirectorySnapshot, path: str) -> list[str]:
+        '''the subfolders of path in the snapshot of a split shard'''
+        pruning = bool(self.prune_matcher or self.prune_ignored)
+        return [
+            child for child, st in snapshot._stat_info.items()
+            if not child == path and S_ISDIR(st.st_mode) and not (pruning and self.prunes_below(child))
+        ]
+
+    def split(self, snapshot: DirectorySnapshot, path: str) -> Tuple[DictSnapshot, dict[str, DictSnapshot]]:
+        '''split the snapshot of path into path without its subfolders and each of the subfolders'''
+        taken_at = getattr(snapshot, 'taken_at', 0)
+        stored = getattr(snapshot, 'stored', False)
+        prefix = os.path.join(path, '')
+        own, children = [], {}
+        for child, st in snapshot._stat_info.items():
+            if child == path:
+                own.append((child, st))
+                continue
+            if not child.startswith(prefix):
+                continue
+            head, sep, _ = child[len(prefix):].partition(os.sep)
+            if not sep:
+                own.append((child, st))
+            if sep or S_ISDIR(st.st_mode):
+                children.setdefault(os.path.join(path, head), []).append((child, st))
+        return DictSnapshot(own, taken_at, stored), {child: DictSnapshot(entries, taken_at, stored) for child, entries in children.items()}
+
+    def split_shard(self, shard: Shard) -> None:
+        '''split a shard and its subfolders until every shard fits in max_entries, the watched folder is always split'''
+        pending = [shard]
+        while pending:
+            shard = pending.pop()
+            if not shard.path == self.watch.path and len(shard.snapshot._stat_info) <= self.max_entries:
+                continue
+            own, children = self.split(shard.snapshot, shard.path)
+            shard.snapshot, shard.split, shard.cost = own, True, len(own._stat_info)
+            for path in self.subfolders(own, shard.path):
+                child = Shard(path, children.get(path) or DictSnapshot(), shard.due)
+                self._shards[path] = child
+                pending.append(child)
+
+    def children(self, path: str) -> list[str]:
+        return [child for child in self._shards if os.path.dirname(child) == path and not child == path]
+
+    def subtree(self, path: str) -> list[str]:
+        prefix = os.path.join(path, '')
+        return [child for child in self._shards if child == path or child.startswith(prefix)]
+
+    def queue_events(self, timeout: int) -> None:
+        '''override'''
+        if not self.watch.is_recursive:
+            return super(ShardedPollingEmitter, self).queue_events(timeout)
+        if self.stopped_event.wait(timeout) or self.is_follower:
+            return
+        if not self.should_keep_running():
+            return
+        self._tick += 1
+        self.poll_shards()
+        if time.time() - self._snapshot_saved_at > self.snapshot_interval:
+            with self._lock:
+                self.save_snapshot()
+
+    def poll_shards(self) -> None:
+        root = self._shards[self.watch.path]
+        others = sorted(
+            (shard for shard in self._shards.values() if shard.due <= self._tick and shard is not root),
+            key=lambda shard: shard.due,
+        )
+        spent = polled = 0
+        for shard in (root, *others):
+            if not self.should_keep_running():
+                return
+            if not self._shards.get(shard.path) is shard:
+                # removed or moved by the poll of its folder
+                continue
+            # the oldest shard still goes when nothing else was polled, it is paced by the throttle anyway
+            if self.budget and spent and spent + shard.cost > self.budget:
+                break
+            try:
+                snapshot = self.take_snapshot(shard.path, not shard.split, shard.snapshot, self._walk_options)
+            except OSError:
+                if shard is root:
+                    self.queue_event(DirDeletedEvent(self.watch.path))
+                    self.stop()
+                    return
+                # the next poll of its folder reports it
+                continue
+            if not snapshot.completed:
+                return
+            with self._lock:
+                if not self._shards.get(shard.path) is shard:
+                    continue
+                self.apply(shard, snapshot)
+            if shard is not root:
+                spent += shard.cost
+                polled += 1
+        logger.debug(f'tick={self._tick} polled={polled}/{len(others)} shards={len(self._shards)} stats={spent}: {self.watch.path!r}')
+
+    def apply(self, shard: Shard, snapshot: DirectorySnapshot) -> None:
+        events = self.diff_with(shard.snapshot, snapshot)
+        shard.snapshot = snapshot
+        # the entry of the folder of a shard is reported by the shard of its parent
+        changed = self.queue_diff(events, exclude=None if shard.path == self.watch.path else shard.path)
+        if shard.split:
+            self.update_shards(shard, events)
+        shard.polled(self._tick, bool(changed), 1 if shard.path == self.watch.path else self.max_interval)
+        if not shard.split and shard.cost > self.max_entries:
+            self.split_shard(shard)
+
+    def update_shards(self, parent: Shard, events: DirectorySnapshotDiff) -> None:
+        current = self.subfolders(parent.snapshot, parent.path)
+        moved = dict(events.dirs_moved)
+        for path in set(self.children(parent.path)) - set(current):
+            dest = moved.get(path)
+            if dest in current and dest not in self._shards:
+                self.move_shards(path, dest)
+            else:
+                for child in self.subtree(path):
+                    shard = self._shards.pop(child)
+                    self.queue_diff(self.diff(shard.snapshot, DictSnapshot()), exclude=child)
+        for path in current:
+            if path not in self._shards:
+                # everything in a new subfolder is reported as created by its first poll
+                self._shards[path] = Shard(path, DictSnapshot(), self._tick)
+
+    def move_shards(self, path: str, dest: str) -> None:
+        '''the entries of a renamed subfolder are moved like DirectorySnapshotDiff does'''
+        for src in self.subtree(path):
+            shard = self._shards.pop(src)
+            entries = []
+            for src_path, st in shard.snapshot._stat_info.items():
+                dest_path = dest + src_path[len(path):]
+                entries.append((dest_path, st))
+                if not src_path == src:
+                    event_class = DirMovedEvent if S_ISDIR(st.st_mode) else FileMovedEvent
+                    self.queue_event(event_class(src_path, dest_path))
+            moved = dest + src[len(path):]
+            snapshot = DictSnapshot(entries, getattr(shard.snapshot, 'taken_at', 0), getattr(shard.snapshot, 'stored', False))
+            self._shards[moved] = Shard(moved, snapshot, self._tick, shard.split)
+
+    def take_over(self, leader: 'ShardedPollingEmitter') -> None:
+        '''override'''
+        super(ShardedPollingEmitter, self).take_over(leader)
+        self._shards, self._tick = leader._shards, leader._tick
+
+    def save_snapshot(self) -> None:
+        '''override'''
+        if self.watch.is_recursive and self._shards:
+            self._snapshot = CombinedSnapshot(shard.snapshot for shard in self._shards.values())
+        super(ShardedPollingEmitter, self).save_snapshot()
 
 
 class SimplePollingObserver(BaseObserver):
 
-    def __init__(self, timeout=DEFAULT_OBSERVER_TIMEOUT):
-        super(SimplePollingObserver, self).__init__(emitter_class=SimplePollingEmitter, timeout=timeout)
+    def __init__(self, timeout=DEFAULT_OBSERVER_TIMEOUT, shards: bool = False, **options):
+        emitter_class = ShardedPollingEmitter if shards else SimplePollingEmitter
+        emitter_class = functools.partial(emitter_class, **options) if options else emitter_class
+        super(SimplePollingObserver, self).__init__(emitter_class=emitter_class, timeout=timeout)
+
+    def schedule(self, event_handler, path, recursive=False, event_filter=None):
+        '''override: let the emitter know the patterns of its handlers'''
+        # "/mnt/gds/" and "/mnt/gds" are the same watch
+        path = os.path.normpath(os.fsdecode(path))
+        watch = super(SimplePollingObserver, self).schedule(event_handler, path, recursive, event_filter)
+        with self._lock:
+            emitter = self._emitter_for_watch.get(watch)
+            matchers = [getattr(handler, 'matcher', None) for handler in self._handlers.get(watch, ())]
+            if isinstance(emitter, SimplePollingEmitter):
+                # a handler without compiled patterns wants everything
+                emitter.handler_matchers = matchers if all(matchers) else []
+                if emitter.share_key and emitter.leader is None:
+                    emitter.leader = emitter.join_group(emitter)
+        return watch
+
+
+class HybridObserver(SimplePollingObserver):
+    '''
+    Watch each scheduled folder with inotify or by polling according to the type of its file system
+
+    Every emitter puts events into the same queue, so all of them are dispatched to the tricks by this observer.
+    '''
+
+    # network and fuse mounts, inotify does not see changes made by other hosts
+    POLLING_FSTYPES = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'fuse', 'fuse.*', 'ceph', 'glusterfs', 'davfs')
+
+    def __init__(self, timeout=DEFAULT_OBSERVER_TIMEOUT, polling_fstypes: Optional[list] = None, **options):
+        super(HybridObserver, self).__init__(timeout, **options)
+        self._polling_emitter_class = self._emitter_class
+        self._emitter_class = self.create_emitter
+        self.polling_fstypes = list(polling_fstypes or self.POLLING_FSTYPES)
+        self._mounts = read_mounts()
+
+    def is_polling_required(self, path: str) -> Tuple[bool, Optional[str]]:
+        fstype = get_fstype(path, self._mounts)
+        # unknown when the mount table is not readable, i.e. not linux
+        return fstype is None or any(fnmatch.fnmatchcase(fstype, pattern) for pattern in self.polling_fstypes), fstype
 
+    def create_emitter(self, event_queue, watch, timeout=DEFAULT_OBSERVER_TIMEOUT, event_filter=None):
+        polling, fstype = self.is_polling_required(watch.path)
+        if not polling:
+            try:
+                from watchdog.observers.inotify import InotifyEmitter
+                emitter = InotifyEmitter(event_queue, watch, DEFAULT_EMITTER_TIMEOUT, event_filter)
+                logger.info(f'inotify ({fstype}): {watch.path!r}')
+                return emitter
+            except Exception:
+                logger.error(traceback.format_exc())
+        logger.info(f'polling ({fstype}): {watch.path!r}')
+        return self._polling_emitter_class(event_queue, watch, timeout=timeout, event_filter=event_filter)
@@ -0,0 +1,393 @@
+import os
+import sys
+import bisect
+import logging
+from array import array
+from collections.abc import Mapping
+from stat import S_ISDIR
+from typing import Optional, Iterator, Tuple, Any
+
+from watchdog.utils.dirsnapshot import DirectorySnapshot
+
+try:
+    from utils import SimpleDirectorySnapShot, SnapshotStat
+except:
+    from .utils import SimpleDirectorySnapShot, SnapshotStat
+
+
+logger = logging.getLogger(__name__)
+
+
+class StatView(Mapping):
+    '''a read-only path -> SnapshotStat mapping over the columns of a ColumnarSnapshot'''
+
+    def __init__(self, snapshot: 'ColumnarSnapshot') -> None:
+        self._snapshot = snapshot
+
+    def __getitem__(self, path: str) -> SnapshotStat:
+        return self._snapshot.stat_info(path)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._snapshot.iter_paths()
+
+    def __len__(self) -> int:
+        return self._snapshot.entry_count()
+
+    def __contains__(self, path: object) -> bool:
+        return self._snapshot.index(path) is not None
+
+    def items(self) -> Iterator[Tuple[str, SnapshotStat]]:
+        snapshot = self._snapshot
+        for i, path in enumerate(snapshot.iter_paths()):
+            yield path, snapshot.stat_at(i)
+
+
+class ColumnarSnapshot(SimpleDirectorySnapShot):
+    '''
+    A snapshot kept in columns sorted by path instead of a dict of os.stat_result
+
+    Every path is interned and the stat values are kept in arrays, so one entry costs the path and 44 bytes.
+    mtime and ctime are kept as float like DirectorySnapshot and the saved snapshots.
+    '''
+
+    COLUMNS = ('_ino', '_dev', '_mtime', '_size', '_mode', '_ctime')
+
+    def __init__(self, *args, **kwds) -> None:
+        self.clear()
+        super(ColumnarSnapshot, self).__init__(*args, **kwds)
+        self.sort()
+        self._stat_info = StatView(self)
+        self._inode_to_path = None
+
+    def clear(self) -> None:
+        self._paths: list[str] = []
+        self.clear_columns()
+
+    def clear_columns(self) -> None:
+        self._ino = array('Q')
+        self._dev = array('Q')
+        self._mtime = array('d')
+        self._size = array('q')
+        self._mode = array('I')
+        self._ctime = array('d')
+
+    def add(self, path: str, st: os.stat_result) -> None:
+        '''override'''
+        self._paths.append(sys.intern(path))
+        self._ino.append(st.st_ino)
+        self._dev.append(st.st_dev)
+        self._mtime.append(st.st_mtime)
+        self._size.append(st.st_size)
+        self._mode.append(st.st_mode)
+        self._ctime.append(st.st_ctime)
+
+    def sort(self) -> None:
+        paths = self._paths
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        if order == list(range(len(order))):
+            return
+        self._paths = [paths[i] for i in order]
+        self.sort_columns(order)
+
+    def sort_columns(self, order: list[int]) -> None:
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[i] for i in order)))
+
+    @classmethod
+    def from_snapshot(cls, snapshot: DirectorySnapshot) -> 'ColumnarSnapshot':
+        '''convert a loaded or an empty snapshot to compare with the columnar ones'''
+        if type(snapshot) is cls:
+            return snapshot
+        instance = cls.__new__(cls)
+        instance.clear()
+        for path in snapshot.paths:
+            instance.add(path, snapshot.stat_info(path))
+        instance.sort()
+        instance._stat_info = StatView(instance)
+        instance._inode_to_path = None
+        instance.recursive = getattr(snapshot, 'recursive', True)
+        instance.taken_at = getattr(snapshot, 'taken_at', 0)
+        instance.completed = getattr(snapshot, 'completed', True)
+        instance.incremental = False
+        instance.listed = instance.carried = instance.pruned = 0
+        return instance
+
+    def index(self, path: str) -> Optional[int]:
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return i
+        return None
+
+    def entry_count(self) -> int:
+        return len(self._ino)
+
+    def key(self, i: int) -> Any:
+        '''the sort key of an entry, entries of two snapshots of the same class compare by it'''
+        return self._paths[i]
+
+    def path_at(self, i: int) -> str:
+        return self._paths[i]
+
+    def iter_paths(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def same_paths(self, other: 'ColumnarSnapshot', i: int, j: int, count: int) -> bool:
+        return self._paths[i:i + count] == other._paths[j:j + count]
+
+    def nbytes(self) -> int:
+        '''approximate memory of the entries'''
+        columns = sum(sys.getsizeof(getattr(self, name)) for name in self.COLUMNS)
+        return columns + sys.getsizeof(self._paths) + sum(sys.getsizeof(path) for path in self._paths)
+
+    def stat_at(self, i: int) -> SnapshotStat:
+        return SnapshotStat(self._ino[i], self._dev[i], self._mtime[i], self._size[i], self._mode[i], self._ctime[i])
+
+    def stat_info(self, path: str) -> SnapshotStat:
+        i = self.index(path)
+        if i is None:
+            raise KeyError(path)
+        return self.stat_at(i)
+
+    @property
+    def paths(self) -> set[str]:
+        return set(self.iter_paths())
+
+    def path(self, id: Tuple[int, int]) -> Optional[str]:
+        if self._inode_to_path is None:
+            self._inode_to_path = {(ino, dev): path for path, ino, dev in zip(self.iter_paths(), self._ino, self._dev)}
+        return self._inode_to_path.get(id)
+
+    def inode(self, path: str) -> Tuple[int, int]:
+        st = self.stat_info(path)
+        return st.st_ino, st.st_dev
+
+    def isdir(self, path: str) -> bool:
+        return S_ISDIR(self.stat_info(path).st_mode)
+
+    def mtime(self, path: str) -> float:
+        return self.stat_info(path).st_mtime
+
+    def size(self, path: str) -> int:
+        return self.stat_info(path).st_size
+
+
+class CompactSnapshot(ColumnarSnapshot):
+    '''
+    A ColumnarSnapshot that shares the path of each directory among its entries
+
+    An entry keeps the index of its parent directory and an interned name, so names repeated in many folders
+    like "poster.jpg" or "Season 01" are stored once. Entries are sorted by (parent directory, name).
+    '''
+
+    def clear(self) -> None:
+        '''override'''
+        self._dirs: list[str] = []
+        self._dir_ids: dict[str, int] = {}
+        self._parent = array('I')
+        self._names: list[str] = []
+        self.clear_columns()
+
+    def add(self, path: str, st: os.stat_result) -> None:
+        '''override'''
+        parent, name = os.path.split(path)
+        parent_id = self._dir_ids.get(parent)
+        if parent_id is None:
+            parent_id = self._dir_ids[parent] = len(self._dirs)
+            self._dirs.append(parent)
+        self._parent.append(parent_id)
+        self._names.append(sys.intern(name))
+        self._ino.append(st.st_ino)
+        self._dev.append(st.st_dev)
+        self._mtime.append(st.st_mtime)
+        self._size.append(st.st_size)
+        self._mode.append(st.st_mode)
+        self._ctime.append(st.st_ctime)
+
+    def sort(self) -> None:
+        '''override'''
+        # the ids are only needed while adding
+        self._dir_ids = {}
+        order = sorted(range(len(self._names)), key=self.key)
+        if order == list(range(len(order))):
+            return
+        self._parent = array('I', (self._parent[i] for i in order))
+        self._names = [self._names[i] for i in order]
+        self.sort_columns(order)
+
+    def index(self, path: str) -> Optional[int]:
+        '''override'''
+        key = os.path.split(path)
+        i = bisect.bisect_left(range(len(self._names)), key, key=self.key)
+        if i < len(self._names) and self.key(i) == key:
+            return i
+        return None
+
+    def key(self, i: int) -> Tuple[str, str]:
+        '''override'''
+        return self._dirs[self._parent[i]], self._names[i]
+
+    def path_at(self, i: int) -> str:
+        '''override'''
+        return os.path.join(self._dirs[self._parent[i]], self._names[i])
+
+    def iter_paths(self) -> Iterator[str]:
+        '''override'''
+        dirs, join = self._dirs, os.path.join
+        return (join(dirs[parent], name) for parent, name in zip(self._parent, self._names))
+
+    def same_paths(self, other: 'CompactSnapshot', i: int, j: int, count: int) -> bool:
+        '''override'''
+        if not self._names[i:i + count] == other._names[j:j + count]:
+            return False
+        a, b = self._dirs, other._dirs
+        return [a[p] for p in self._parent[i:i + count]] == [b[p] for p in other._parent[j:j + count]]
+
+    def nbytes(self) -> int:
+        '''override'''
+        columns = sum(sys.getsizeof(getattr(self, name)) for name in self.COLUMNS + ('_parent',))
+        names = sys.getsizeof(self._names) + sum(sys.getsizeof(name) for name in set(self._names))
+        dirs = sys.getsizeof(self._dirs) + sum(sys.getsizeof(path) for path in self._dirs)
+        return columns + names + dirs
+
+
+class ColumnarSnapshotDiff:
+    '''
+    DirectorySnapshotDiff of two ColumnarSnapshot of the same class in one merge pass over the sorted entries
+
+    Runs of identical entries are compared a block at a time by the arrays.
+    Moves are matched between the created and the deleted paths by inode, so a hard link left at an unchanged path is not a move.
+    '''
+
+    BLOCK = 1024
+
+    def __init__(self, ref: ColumnarSnapshot, snapshot: ColumnarSnapshot, ignore_device: bool = False) -> None:
+        created: list[int] = []
+        deleted: list[int] = []
+        modified: list[int] = []
+        a, b = ref, snapshot
+        columns = [(a._ino, b._ino), (a._mtime, b._mtime), (a._size, b._size)]
+        if not ignore_device:
+            columns.append((a._dev, b._dev))
+        na, nb = a.entry_count(), b.entry_count()
+        i = j = 0
+        block = self.BLOCK
+        while i < na and j < nb:
+            if i + block <= na and j + block <= nb and \
+               all(x[i:i + block] == y[j:j + block] for x, y in columns) and a.same_paths(b, i, j, block):
+                i += block
+                j += block
+                continue
+            for _ in range(block):
+                if i >= na or j >= nb:
+                    break
+                pa, pb = a.key(i), b.key(j)
+                if pa == pb:
+                    if a._ino[i] != b._ino[j] or (not ignore_device and a._dev[i] != b._dev[j]):
+                        deleted.append(i)
+                        created.append(j)
+                    elif a._mtime[i] != b._mtime[j] or a._size[i] != b._size[j]:
+                        modified.append(i)
+                    i += 1
+                    j += 1
+                elif pa < pb:
+                    deleted.append(i)
+                    i += 1
+                else:
+                    created.append(j)
+                    j += 1
+        deleted.extend(range(i, na))
+        created.extend(range(j, nb))
+
+        # deleted inode -> index in ref
+        key = (lambda s, k: s._ino[k]) if ignore_device else (lambda s, k: (s._ino[k], s._dev[k]))
+        gone = {key(a, k): k for k in deleted}
+        moved: list[Tuple[int, int]] = []
+        if gone:
+            remains = []
+            for k in created:
+                old = gone.pop(key(b, k), None)
+                if old is None:
+                    remains.append(k)
+                else:
+                    moved.append((old, k))
+            created = remains
+            moved_from = {old for old, _ in moved}
+            deleted = [k for k in deleted if k not in moved_from]
+        for old, new in moved:
+            if a._mtime[old] != b._mtime[new] or a._size[old] != b._size[new]:
+                modified.append(old)
+
+        a_isdir = lambda k: S_ISDIR(a._mode[k])
+        self._dirs_created = [b.path_at(k) for k in created if S_ISDIR(b._mode[k])]
+        self._files_created = [b.path_at(k) for k in created if not S_ISDIR(b._mode[k])]
+        self._dirs_deleted = [a.path_at(k) for k in deleted if a_isdir(k)]
+        self._files_deleted = [a.path_at(k) for k in deleted if not a_isdir(k)]
+        self._dirs_modified = [a.path_at(k) for k in modified if a_isdir(k)]
+        self._files_modified = [a.path_at(k) for k in modified if not a_isdir(k)]
+        self._dirs_moved = [(a.path_at(old), b.path_at(new)) for old, new in moved if a_isdir(old)]
+        self._files_moved = [(a.path_at(old), b.path_at(new)) for old, new in moved if not a_isdir(old)]
+
+    @property
+    def files_created(self) -> list[str]:
+        return self._files_created
+
+    @property
+    def files_deleted(self) -> list[str]:
+        return self._files_deleted
+
+    @property
+    def files_modified(self) -> list[str]:
+        return self._files_modified
+
+    @property
+    def files_moved(self) -> list[Tuple[str, str]]:
+        return self._files_moved
+
+    @property
+    def dirs_created(self) -> list[str]:
+        return self._dirs_created
+
+    @property
+    def dirs_deleted(self) -> list[str]:
+        return self._dirs_deleted
+
+    @property
+    def dirs_modified(self) -> list[str]:
+        return self._dirs_modified
+
+    @property
+    def dirs_moved(self) -> list[Tuple[str, str]]:
+        return self._dirs_moved
+
+
+class PathSnapshotDiff(ColumnarSnapshotDiff):
+    '''
+    DirectorySnapshotDiff of any two snapshots by path, mtime and size without the inode and device numbers
+
+    rclone, FUSE and other network mounts number their inodes again on every mount, so the first poll after a restart
+    compares with the saved snapshot this way. A move while stopped is reported as deleted and created.
+    '''
+
+    def __init__(self, ref: DirectorySnapshot, snapshot: DirectorySnapshot) -> None:
+        '''override'''
+        old, new = ref.paths, snapshot.paths
+        created = new - old
+        deleted = old - new
+        modified = set()
+        for path in old & new:
+            a, b = ref.stat_info(path), snapshot.stat_info(path)
+            if not S_ISDIR(a.st_mode) == S_ISDIR(b.st_mode):
+                deleted.add(path)
+                created.add(path)
+            elif a.st_mtime != b.st_mtime or a.st_size != b.st_size:
+                modified.add(path)
+        isdir = lambda s, path: S_ISDIR(s.stat_info(path).st_mode)
+        self._dirs_created = sorted(path for path in created if isdir(snapshot, path))
+        self._files_created = sorted(path for path in created if not isdir(snapshot, path))
+        self._dirs_deleted = sorted(path for path in deleted if isdir(ref, path))
+        self._files_deleted = sorted(path for path in deleted if not isdir(ref, path))
+        self._dirs_modified = sorted(path for path in modified if isdir(ref, path))
+        self._files_modified = sorted(path for path in modified if not isdir(ref, path))
+        self._dirs_moved = []
+        self._files_moved = []
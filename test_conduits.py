@@ -0,0 +1,48 @@
+try:
+    from conduits import RcloneConduit
+except:
+    from .conduits import RcloneConduit
+
+
+def make_rclone(result: dict, batch_recursive: bool = False) -> tuple[RcloneConduit, list, list]:
+    conduit = RcloneConduit('rclone', ['created'], 0, rc_url='http://rclone:5572', rc_user='', rc_pass='', vfs='gds:',
+                            batch_recursive=batch_recursive)
+    batched, fallbacks = [], []
+
+    def _refresh(remote_path, fs, recursive=False):
+        batched.append((remote_path, recursive))
+        return {'result': {path: result.get(path, 'OK') for path in remote_path}}
+
+    conduit._refresh = _refresh
+    conduit.refresh = lambda local_path, is_directory=False: fallbacks.append(local_path)
+    return conduit, batched, fallbacks
+
+
+def test_refresh_batch_missing_child_of_batched_parent():
+    conduit, batched, fallbacks = make_rclone({'tv/ShowA/S02': 'file does not exist'})
+    conduit.refresh_batch([
+        ('tv/ShowA', '/mnt/tv/ShowA/e01.mkv', False),
+        ('tv/ShowA/S02', '/mnt/tv/ShowA/S02/e01.mkv', False),
+    ])
+    assert batched == [(['tv/ShowA', 'tv/ShowA/S02'], False)]
+    assert fallbacks == ['/mnt/tv/ShowA/S02/e01.mkv']
+
+
+def test_refresh_batch_recursive_follows_covering_ancestor():
+    conduit, batched, fallbacks = make_rclone({'tv/ShowA': 'file does not exist'}, batch_recursive=True)
+    conduit.refresh_batch([
+        ('tv/ShowA', '/mnt/tv/ShowA/e01.mkv', False),
+        ('tv/ShowA/S02', '/mnt/tv/ShowA/S02/e01.mkv', False),
+    ])
+    assert batched == [(['tv/ShowA'], True)]
+    assert fallbacks == ['/mnt/tv/ShowA/e01.mkv', '/mnt/tv/ShowA/S02/e01.mkv']
+
+
+def test_rclone_remembers_only_missing_directories():
+    conduit, _, _ = make_rclone({})
+    conduit.remember({'result': {'tv/ShowA': 'OK', 'tv/ShowB': 'file does not exist'}})
+    assert len(conduit.exists_cache) == 1
+    assert conduit.exists_cache.get('tv/ShowB') is False
+    # a missing directory that appeared is forgotten
+    conduit.remember({'result': {'tv/ShowB': 'OK'}})
+    assert len(conduit.exists_cache) == 0
@@ -0,0 +1,218 @@
+import time
+import sqlite3
+import threading
+
+import pytest
+
+from watchdog.events import FileCreatedEvent
+
+try:
+    from dispatchers import ConduitQueue, Debouncer
+    from mocks import MockServer
+    from tricks import SimpleTrick
+except:
+    from .dispatchers import ConduitQueue, Debouncer
+    from .mocks import MockServer
+    from .tricks import SimpleTrick
+
+
+def wait_until(predicate, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def event(event_type: str, src_path: str, dest_path: str = '', is_directory: bool = False) -> dict:
+    return {'event_type': event_type, 'is_directory': is_directory, 'src_path': src_path, 'dest_path': dest_path, 'is_synthetic': False}
+
+
+def debounce(*events: dict, **options) -> list[tuple]:
+    received = []
+    debouncer = Debouncer('test', received.append, **{'window': 60, **options})
+    for item in events:
+        debouncer.put(item)
+    debouncer.stop()
+    return sorted((item['event_type'], item['src_path'], item['dest_path']) for item in received)
+
+
+@pytest.mark.parametrize('events, expected', [
+    # created + modified + closed: created
+    ([event('created', '/a'), event('modified', '/a'), event('closed', '/a')], [('created', '/a', '')]),
+    ([event('modified', '/a'), event('created', '/a')], [('created', '/a', '')]),
+    ([event('opened', '/a'), event('modified', '/a'), event('opened', '/a')], [('modified', '/a', '')]),
+    # created + deleted: nothing
+    ([event('created', '/a'), event('modified', '/a'), event('deleted', '/a')], []),
+    ([event('modified', '/a'), event('deleted', '/a')], [('deleted', '/a', '')]),
+    # deleted + created: created
+    ([event('deleted', '/a'), event('created', '/a')], [('created', '/a', '')]),
+    ([event('deleted', '/a'), event('modified', '/a')], [('modified', '/a', '')]),
+    # created + moved: created at the destination
+    ([event('created', '/a'), event('moved', '/a', '/b')], [('created', '/b', '')]),
+    ([event('created', '/a'), event('moved', '/a', '/b'), event('moved', '/b', '/c')], [('created', '/c', '')]),
+    # a chain of moves is one move from the first source to the last destination
+    ([event('moved', '/a', '/b'), event('moved', '/b', '/c')], [('moved', '/a', '/c')]),
+    ([event('moved', '/a', '/b'), event('modified', '/b')], [('moved', '/a', '/b')]),
+    ([event('moved', '/a', '/b'), event('deleted', '/b')], [('deleted', '/a', '')]),
+    ([event('modified', '/a'), event('moved', '/a', '/b')], [('moved', '/a', '/b')]),
+    # other paths are not merged
+    ([event('created', '/a'), event('deleted', '/b')], [('created', '/a', ''), ('deleted', '/b', '')]),
+])
+def test_debouncer_merges_events_of_a_path(events, expected):
+    assert debounce(*events) == expected
+
+
+def test_debouncer_counts_merged_and_cancelled():
+    debouncer = Debouncer('test', lambda item: None, window=60)
+    for item in (event('created', '/a'), event('modified', '/a'), event('deleted', '/a'), event('created', '/b')):
+        debouncer.put(item)
+    debouncer.stop()
+    assert debouncer.stats == {'received': 4, 'merged': 2, 'cancelled': 1, 'emitted': 1}
+
+
+def test_debouncer_waits_for_the_window():
+    received = []
+    debouncer = Debouncer('test', received.append, window=0.2, max_wait=60)
+    debouncer.put(event('created', '/a'))
+    debouncer.flush()
+    assert received == []
+    assert wait_until(lambda: received)
+    debouncer.stop()
+    assert [item['event_type'] for item in received] == ['created']
+
+
+def test_debouncer_flushes_after_max_wait():
+    received = []
+    debouncer = Debouncer('test', received.append, window=60, max_wait=0.2)
+    debouncer.put(event('created', '/a'))
+    # a path that keeps changing is still passed on once max_wait has passed since its first event
+    deadline = time.time() + 5
+    while not received and time.time() < deadline:
+        debouncer.put(event('modified', '/a'))
+        debouncer.flush()
+        time.sleep(0.02)
+    debouncer.stop()
+    assert [item['event_type'] for item in received] == ['created']
+
+
+class Gate:
+    '''a target that holds the worker of a queue until it is opened'''
+
+    def __init__(self) -> None:
+        self.received = []
+        self.entered = threading.Event()
+        self.opened = threading.Event()
+
+    def __call__(self, item: dict) -> None:
+        self.entered.set()
+        self.opened.wait(5)
+        self.received.append(item['src_path'])
+
+
+def full_queue(policy: str) -> tuple[ConduitQueue, Gate]:
+    '''a queue of size 1 whose worker holds /1 and whose slot holds /2'''
+    gate = Gate()
+    conduit_queue = ConduitQueue('test', gate, size=1, policy=policy, stop_timeout=5)
+    conduit_queue.put(event('created', '/1'))
+    assert gate.entered.wait(5)
+    conduit_queue.put(event('created', '/2'))
+    assert conduit_queue.depth == 1
+    return conduit_queue, gate
+
+
+def put_later(conduit_queue: ConduitQueue, item: dict) -> threading.Thread:
+    thread = threading.Thread(target=conduit_queue.put, args=(item,), daemon=True)
+    thread.start()
+    thread.join(0.2)
+    return thread
+
+
+def test_queue_block_waits_for_room():
+    conduit_queue, gate = full_queue('block')
+    thread = put_later(conduit_queue, event('created', '/3'))
+    assert thread.is_alive()
+    gate.opened.set()
+    thread.join(5)
+    conduit_queue.stop()
+    assert gate.received == ['/1', '/2', '/3']
+    assert conduit_queue.stats['dropped'] == 0
+
+
+def test_queue_drop_oldest_discards_the_oldest_pending():
+    conduit_queue, gate = full_queue('drop-oldest')
+    conduit_queue.put(event('created', '/3'))
+    assert conduit_queue.depth == 1
+    gate.opened.set()
+    conduit_queue.stop()
+    assert gate.received == ['/1', '/3']
+    assert conduit_queue.stats['dropped'] == 1
+
+
+def test_queue_coalesce_discards_a_pending_duplicate_and_waits_otherwise():
+    conduit_queue, gate = full_queue('coalesce')
+    conduit_queue.put(event('created', '/2'))
+    assert conduit_queue.stats['coalesced'] == 1
+    thread = put_later(conduit_queue, event('created', '/3'))
+    assert thread.is_alive()
+    gate.opened.set()
+    thread.join(5)
+    conduit_queue.stop()
+    assert gate.received == ['/1', '/2', '/3']
+
+
+def test_queue_stop_delivers_the_pending_events():
+    received = []
+    conduit_queue = ConduitQueue('test', lambda item: (time.sleep(0.01), received.append(item['src_path'])), size=100)
+    for i in range(20):
+        conduit_queue.put(event('created', f'/{i}'))
+    conduit_queue.stop()
+    assert received == [f'/{i}' for i in range(20)]
+    assert conduit_queue.stats['processed'] == 20
+
+
+def test_queue_stop_drops_a_blocked_event():
+    conduit_queue, gate = full_queue('block')
+    conduit_queue.stop_timeout = 0.1
+    thread = put_later(conduit_queue, event('created', '/3'))
+    stopping = threading.Thread(target=conduit_queue.stop, daemon=True)
+    stopping.start()
+    # the blocked put gives up once the queue closes, not when the worker is released
+    thread.join(5)
+    assert not thread.is_alive()
+    gate.opened.set()
+    stopping.join(5)
+    assert '/3' not in gate.received
+
+
+def test_journal_retries_a_failing_service(tmp_path):
+    server = MockServer(error_rate=1).start()
+    path = str(tmp_path / 'journal.db')
+    try:
+        trick = SimpleTrick(
+            conduits=[{
+                'class': 'conduits.RcloneConduit', 'name': 'rclone',
+                'rc_url': server.url, 'rc_user': '', 'rc_pass': '', 'vfs': 'gds:',
+            }],
+            journal={'path': path, 'commit_interval': 0.01, 'retry_base': 0.01, 'retry_max': 0.05, 'max_retries': 0, 'stop_timeout': 0.2},
+        )
+        trick.on_any_event(FileCreatedEvent('/mnt/gds/movies/a.mkv'))
+        assert wait_until(lambda: trick.journal.stats['retried'] > 0)
+        trick.stop()
+    finally:
+        server.stop()
+    assert trick.journal.stats['delivered'] == 0
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT offset FROM offsets WHERE conduit = 'rclone'").fetchone() == (0,)
+    assert db.execute('SELECT COUNT(*) FROM events').fetchone() == (1,)
+    db.close()
+
+
+def test_journal_rejects_stages_holding_events(tmp_path):
+    for conduit in (
+        {'class': 'conduits.DummyConduit', 'name': 'dummy', 'debounce': {'window': 1}},
+        {'class': 'conduits.PlexConduit', 'name': 'plex', 'plex_url': 'http://plex:32400', 'plex_token': '', 'scan_window': 1},
+    ):
+        with pytest.raises(ValueError):
+            SimpleTrick(conduits=[conduit], journal={'path': str(tmp_path / 'journal.db')})
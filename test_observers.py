@@ -0,0 +1,133 @@
+import os
+import queue
+
+import pytest
+
+from watchdog.observers.api import ObservedWatch
+from watchdog.events import FileModifiedEvent
+
+try:
+    from observers import SimplePollingEmitter, ShardedPollingEmitter
+    from utils import SnapshotStat, PathMatcher
+except:
+    from .observers import SimplePollingEmitter, ShardedPollingEmitter
+    from .utils import SnapshotStat, PathMatcher
+
+
+def make_tree(root, folders: int = 3, files: int = 3) -> None:
+    for i in range(folders):
+        folder = root / f'folder{i}' / 'sub'
+        folder.mkdir(parents=True)
+        for j in range(files):
+            (folder / f'file{j}.mkv').write_text('x')
+
+
+def remounted_stat(path: str) -> SnapshotStat:
+    '''os.stat of a mount that numbers its inodes and devices again'''
+    st = os.stat(path)
+    return SnapshotStat(st.st_ino + 1000, st.st_dev + 1, st.st_mtime, st.st_size, st.st_mode, st.st_ctime)
+
+
+def drain(event_queue: queue.Queue) -> list:
+    events = []
+    while not event_queue.empty():
+        events.append(event_queue.get()[0])
+    return events
+
+
+@pytest.mark.parametrize('emitter_class', [SimplePollingEmitter, ShardedPollingEmitter])
+@pytest.mark.parametrize('diff_engine', ['watchdog', 'merge', 'compact'])
+def test_restart_with_new_inode_numbers(tmp_path, emitter_class, diff_engine):
+    root = tmp_path / 'root'
+    make_tree(root)
+    watch = ObservedWatch(str(root), True)
+    options = {'snapshot_dir': str(tmp_path / 'snapshots'), 'diff_engine': diff_engine, 'shared': False}
+    if emitter_class is ShardedPollingEmitter:
+        options['shard_max_entries'] = 2
+    before = emitter_class(queue.Queue(), watch, 0, **options)
+    before.on_thread_start()
+    before.on_thread_stop()
+
+    modified = root / 'folder1' / 'sub' / 'file0.mkv'
+    modified.write_text('changed')
+    event_queue = queue.Queue()
+    after = emitter_class(event_queue, watch, 0, stat=remounted_stat, **options)
+    after.on_thread_start()
+    for _ in range(4):
+        after.queue_events(0)
+    assert drain(event_queue) == [FileModifiedEvent(str(modified))]
+
+
+def event_set(events: list, split_moves: bool = False) -> set:
+    result = set()
+    for event in events:
+        if split_moves and event.event_type == 'moved':
+            result.add(('deleted', event.is_directory, event.src_path))
+            result.add(('created', event.is_directory, event.dest_path))
+        else:
+            result.add((event.event_type, event.is_directory, event.src_path, *([event.dest_path] if event.dest_path else [])))
+    return result
+
+
+def mkdir_with_files(folder, files: int = 3) -> None:
+    folder.mkdir(parents=True)
+    for j in range(files):
+        (folder / f'file{j}.mkv').write_text('x')
+
+
+@pytest.mark.parametrize('mutation, split_moves', [
+    # inside a shard
+    (lambda root: (root / 'folder0' / 'sub' / 'file0.mkv').write_text('changed'), False),
+    (lambda root: (root / 'folder0' / 'sub' / 'file1.mkv').unlink(), False),
+    (lambda root: (root / 'folder0' / 'sub' / 'new.mkv').write_text('x'), False),
+    (lambda root: (root / 'folder0' / 'sub' / 'file1.mkv').rename(root / 'folder0' / 'sub' / 'moved.mkv'), False),
+    # a new folder becomes a shard and a full one is split
+    (lambda root: mkdir_with_files(root / 'folder9' / 'sub'), False),
+    (lambda root: mkdir_with_files(root / 'folder1' / 'sub' / 'deeper'), False),
+    # a shard removed with everything in it
+    (lambda root: [path.unlink() for path in (root / 'folder2' / 'sub').iterdir()] and (root / 'folder2' / 'sub').rmdir(), False),
+    # a shard renamed within its folder is moved as a whole
+    (lambda root: (root / 'folder1' / 'sub').rename(root / 'folder1' / 'renamed'), False),
+    (lambda root: (root / 'folder1').rename(root / 'folder8'), False),
+    # moves across shards are reported as deleted and created
+    (lambda root: (root / 'folder0' / 'sub' / 'file2.mkv').rename(root / 'folder1' / 'sub' / 'file2.mkv'), True),
+    (lambda root: (root / 'folder0' / 'sub').rename(root / 'folder1' / 'sub' / 'moved'), True),
+])
+def test_sharded_emitter_matches_simple_emitter(tmp_path, mutation, split_moves):
+    root = tmp_path / 'root'
+    make_tree(root)
+    watch = ObservedWatch(str(root), True)
+    simple_queue, sharded_queue = queue.Queue(), queue.Queue()
+    simple = SimplePollingEmitter(simple_queue, watch, 0, shared=False)
+    sharded = ShardedPollingEmitter(sharded_queue, watch, 0, shared=False, shard_max_entries=4, shard_max_interval=1)
+    simple.on_thread_start()
+    sharded.on_thread_start()
+    shards = len(sharded._shards)
+    assert shards > 4
+
+    mutation(root)
+    simple.queue_events(0)
+    # new shards are polled on the next tick
+    for _ in range(3):
+        sharded.queue_events(0)
+    expected = event_set(drain(simple_queue), split_moves)
+    assert expected
+    assert event_set(drain(sharded_queue), split_moves) == expected
+    # the shards follow the folders
+    folders = {str(path) for path in root.rglob('*') if path.is_dir()} | {str(root)}
+    assert set(sharded._shards) <= folders
+
+
+def test_prune_ignored_skips_only_folders_of_directory_patterns(tmp_path):
+    root = tmp_path / 'root'
+    mkdir_with_files(root / 'foo.tmp', 1)
+    mkdir_with_files(root / 'movie' / '@eaDir', 1)
+    (root / 'movie' / 'a.tmp').write_text('x')
+    emitter = SimplePollingEmitter(queue.Queue(), ObservedWatch(str(root), True), 0, shared=False, prune_ignored=True)
+    emitter.handler_matchers = [PathMatcher(None, ['*.tmp', '*/@eaDir/*'])]
+    paths = set(emitter.take_snapshot(str(root), True)._stat_info)
+    # the files of a folder named like an ignored file are still reported
+    assert str(root / 'foo.tmp' / 'file0.mkv') in paths
+    assert str(root / 'movie' / 'a.tmp') in paths
+    assert str(root / 'movie' / '@eaDir') in paths
+    assert str(root / 'movie' / '@eaDir' / 'file0.mkv') not in paths
@@ -0,0 +1,121 @@
+import os
+import random
+import itertools
+from stat import S_IFDIR, S_IFREG
+from typing import Iterator
+
+import pytest
+
+from watchdog.utils.dirsnapshot import DirectorySnapshotDiff
+
+try:
+    from observers import DictSnapshot
+    from snapshots import ColumnarSnapshot, CompactSnapshot, ColumnarSnapshotDiff
+    from utils import SnapshotStat
+except:
+    from .observers import DictSnapshot
+    from .snapshots import ColumnarSnapshot, CompactSnapshot, ColumnarSnapshotDiff
+    from .utils import SnapshotStat
+
+
+ROOT = '/r'
+FIELDS = ('files_created', 'files_deleted', 'files_modified', 'files_moved', 'dirs_created', 'dirs_deleted', 'dirs_modified', 'dirs_moved')
+
+
+def entry(ino: int, is_dir: bool = False, mtime: float = 1.0, size: int = 1) -> SnapshotStat:
+    return SnapshotStat(ino, 1, mtime, size, S_IFDIR if is_dir else S_IFREG, mtime)
+
+
+def generate(rng: random.Random, inodes: Iterator, entries: int = 200) -> dict:
+    tree = {ROOT: entry(next(inodes), True)}
+    dirs = [ROOT]
+    for i in range(entries):
+        is_dir = rng.random() < 0.2
+        path = os.path.join(rng.choice(dirs), f'{"d" if is_dir else "f"}{i}')
+        tree[path] = entry(next(inodes), is_dir, rng.randint(1, 3), rng.randint(1, 3))
+        if is_dir:
+            dirs.append(path)
+    return tree
+
+
+def mutate(rng: random.Random, inodes: Iterator, tree: dict) -> dict:
+    tree = dict(tree)
+    for i in range(rng.randint(1, 20)):
+        paths = [path for path in tree if not path == ROOT]
+        dirs = [path for path, st in tree.items() if st.st_mode == S_IFDIR]
+        if not paths:
+            break
+        path = rng.choice(paths)
+        st = tree[path]
+        match rng.choice(('modify', 'move', 'delete', 'create', 'replace', 'reuse')):
+            case 'modify':
+                tree[path] = st._replace(st_mtime=st.st_mtime + 1, st_size=st.st_size + rng.randint(0, 1))
+            case 'move':
+                # a folder is moved with everything in it
+                dest_dir = rng.choice([d for d in dirs if not (d == path or d.startswith(path + '/'))])
+                dest = os.path.join(dest_dir, f'm{i}')
+                for child in [p for p in tree if p == path or p.startswith(path + '/')]:
+                    tree[dest + child[len(path):]] = tree.pop(child)
+            case 'delete':
+                for child in [p for p in tree if p == path or p.startswith(path + '/')]:
+                    del tree[child]
+            case 'create':
+                tree[os.path.join(rng.choice(dirs), f'c{i}')] = entry(next(inodes), rng.random() < 0.2)
+            case 'replace':
+                # another file at the same path
+                if not st.st_mode == S_IFDIR:
+                    tree[path] = entry(next(inodes), mtime=st.st_mtime, size=st.st_size)
+            case 'reuse':
+                # the inode of a deleted file is given to a new file at another path
+                if not st.st_mode == S_IFDIR:
+                    del tree[path]
+                    tree[os.path.join(rng.choice(dirs), f'r{i}')] = entry(st.st_ino, mtime=st.st_mtime + 1)
+    return tree
+
+
+def events(diff) -> dict:
+    return {name: sorted(getattr(diff, name)) for name in FIELDS}
+
+
+@pytest.mark.parametrize('snapshot_class', [ColumnarSnapshot, CompactSnapshot])
+@pytest.mark.parametrize('seed', range(50))
+def test_merge_diff_matches_watchdog(snapshot_class, seed):
+    rng = random.Random(seed)
+    inodes = itertools.count(100)
+    before = generate(rng, inodes)
+    after = mutate(rng, inodes, before)
+    ref, snapshot = DictSnapshot(before.items()), DictSnapshot(after.items())
+    expected = events(DirectorySnapshotDiff(ref, snapshot))
+    merged = ColumnarSnapshotDiff(snapshot_class.from_snapshot(ref), snapshot_class.from_snapshot(snapshot))
+    assert events(merged) == expected
+
+
+def test_merge_diff_of_an_inode_reused_at_another_path():
+    before = {ROOT: entry(1, True), '/r/a': entry(2), '/r/b': entry(3)}
+    # /r/a is deleted and its inode is given to the new /r/c, /r/b is replaced at the same path
+    after = {ROOT: entry(1, True), '/r/b': entry(4), '/r/c': entry(2, mtime=2)}
+    ref, snapshot = DictSnapshot(before.items()), DictSnapshot(after.items())
+    expected = events(DirectorySnapshotDiff(ref, snapshot))
+    assert expected['files_moved'] == [('/r/a', '/r/c')]
+    for snapshot_class in (ColumnarSnapshot, CompactSnapshot):
+        assert events(ColumnarSnapshotDiff(snapshot_class.from_snapshot(ref), snapshot_class.from_snapshot(snapshot))) == expected
+
+
+def test_merge_diff_of_real_trees(tmp_path):
+    for i in range(5):
+        folder = tmp_path / f'd{i}'
+        folder.mkdir()
+        for j in range(5):
+            (folder / f'f{j}').write_text('x')
+    refs = {snapshot_class: snapshot_class(str(tmp_path)) for snapshot_class in (ColumnarSnapshot, CompactSnapshot)}
+    watchdog_ref = DictSnapshot(refs[ColumnarSnapshot]._stat_info.items())
+    (tmp_path / 'd0' / 'f0').write_text('changed')
+    (tmp_path / 'd1').rename(tmp_path / 'd5')
+    (tmp_path / 'd2' / 'f1').rename(tmp_path / 'd3' / 'f9')
+    (tmp_path / 'd4' / 'f2').unlink()
+    (tmp_path / 'd4' / 'new').write_text('x')
+    snapshots = {snapshot_class: snapshot_class(str(tmp_path)) for snapshot_class in refs}
+    expected = events(DirectorySnapshotDiff(watchdog_ref, DictSnapshot(snapshots[ColumnarSnapshot]._stat_info.items())))
+    assert expected['dirs_moved']
+    for snapshot_class, ref in refs.items():
+        assert events(ColumnarSnapshotDiff(ref, snapshots[snapshot_class])) == expected
@@ -0,0 +1,164 @@
+import email.utils
+import datetime
+
+import pytest
+
+from watchdog.utils.patterns import match_any_paths
+
+try:
+    from mocks import MockServer
+    from utils import PathMatcher, RateLimiter, request
+except:
+    from .mocks import MockServer
+    from .utils import PathMatcher, RateLimiter, request
+
+
+PATHS = [
+    '/mnt/gds/movies/Movie (2020)/Movie (2020).mkv',
+    '/mnt/gds/movies/Movie (2020)/movie (2020).MKV',
+    '/mnt/gds/movies/Movie (2020)/poster.jpg',
+    '/mnt/gds/movies/Movie (2020)/@eaDir/poster.jpg@SynoEAStream',
+    '/mnt/gds/movies/Movie (2020)/@eaDir',
+    '/mnt/gds/tv/Show/Season 01/Show.S01E01.mkv',
+    '/mnt/gds/tv/Show/Season 01/Show.S01E01.partial~',
+    '/mnt/gds/tv/Show/Season 01',
+    '/mnt/gds/tv/.Trash-1000/files/a.mkv',
+    '/mnt/gds/tv/Show/a.b.c',
+    '/mnt/gds/tv/Show/.hidden',
+    '/mnt/gds/tv/Show/file[1].mkv',
+    '/mnt/gds/tv/Show/file1.mkv',
+    '/mnt/gds/tv/Show/noext',
+]
+
+CASES = [
+    # patterns, ignore_patterns
+    (None, None),
+    (['*'], None),
+    (['*.mkv'], None),
+    (['*.mkv', '*.jpg'], ['*/@eaDir/*']),
+    (['*'], ['*.partial~', '*.jpg']),
+    (['*.MKV'], None),
+    (['*/Season ??/*'], None),
+    (['/mnt/gds/tv/*'], None),
+    (['/mnt/gds/tv/*/*'], None),
+    (['tv/*/*.mkv'], None),
+    (['*.mkv'], ['*/.Trash-*/*', '*/@eaDir']),
+    (['file[0-9].mkv', '*[!a-z].mkv'], None),
+    (['*.b.c', '.hidden'], None),
+    (['*'], ['*/Season 01']),
+    (['*/Show/*'], ['*.mkv']),
+    (['*.jpg', 'poster.*'], ['Movie (2020)/*.jpg']),
+]
+
+
+@pytest.mark.parametrize('case_sensitive', [True, False])
+@pytest.mark.parametrize('patterns, ignore_patterns', CASES)
+def test_path_matcher_matches_watchdog(patterns, ignore_patterns, case_sensitive):
+    matcher = PathMatcher(patterns, ignore_patterns, case_sensitive)
+    for path in PATHS:
+        expected = match_any_paths([path], patterns, ignore_patterns, case_sensitive)
+        assert matcher.match_any([path]) == expected, path
+
+
+def test_path_matcher_ignore_patterns_win():
+    matcher = PathMatcher(['*.mkv'], ['*/Season 01/*'])
+    assert matcher.match('/tv/Show/Season 02/a.mkv')
+    assert not matcher.match('/tv/Show/Season 01/a.mkv')
+    # one matching path of a move is enough
+    assert matcher.match_any(['/tv/Show/Season 01/a.mkv', '/tv/Show/Season 02/a.mkv'])
+
+
+def test_path_matcher_ignores_below():
+    matcher = PathMatcher(None, ['*/@eaDir/*', '*.tmp'])
+    assert matcher.ignores_below('/mnt/movies/@eaDir')
+    assert not matcher.ignores('/mnt/movies/@eaDir')
+    # a file pattern does not reach the entries of a folder with a matching name
+    assert matcher.ignores('/mnt/movies/foo.tmp')
+    assert not matcher.ignores_below('/mnt/movies/foo.tmp')
+
+
+def test_path_matcher_rejects_conflicts():
+    with pytest.raises(ValueError):
+        PathMatcher(['*.mkv'], ['*.mkv'])
+
+
+class Clock:
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_rate_limiter_refills_tokens_up_to_burst():
+    clock = Clock()
+    limiter = RateLimiter('test', rate=2, burst=3, clock=clock)
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert limiter.try_acquire() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert limiter.try_acquire() == 0
+    # a long pause refills the bucket up to burst only
+    clock.now += 60
+    assert [limiter.try_acquire() for _ in range(4)] == [0, 0, 0, pytest.approx(0.5)]
+
+
+def test_rate_limiter_caps_requests_in_flight():
+    limiter = RateLimiter('test', max_in_flight=2, clock=Clock())
+    assert [limiter.try_acquire() for _ in range(2)] == [0, 0]
+    assert limiter.try_acquire() is None
+    limiter.release()
+    assert limiter.try_acquire() == 0
+
+
+@pytest.mark.parametrize('headers, content, delay', [
+    ({'Retry-After': '7'}, '', 7),
+    ({'Retry-After': '0.5'}, '', 0.5),
+    ({}, '{"message": "You are being rate limited.", "retry_after": 1.5, "global": false}', 1.5),
+    # exponential backoff without a hint: retry_base * 2 ** attempt
+    ({}, '', 4),
+    # never longer than retry_max
+    ({'Retry-After': '3600'}, '', 60),
+])
+def test_rate_limiter_pauses_on_429(headers, content, delay):
+    clock = Clock()
+    limiter = RateLimiter('test', max_retries=3, clock=clock)
+    assert limiter.feedback(429, headers, content, 2)
+    assert limiter.try_acquire() == pytest.approx(delay)
+    clock.now += delay
+    assert limiter.try_acquire() == 0
+
+
+def test_rate_limiter_reads_retry_after_dates():
+    limiter = RateLimiter('test', clock=Clock())
+    value = email.utils.format_datetime(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30), usegmt=True)
+    assert limiter.retry_after({'Retry-After': value}, '') == pytest.approx(30, abs=2)
+
+
+def test_rate_limiter_gives_up_after_max_retries():
+    limiter = RateLimiter('test', max_retries=2, clock=Clock())
+    assert limiter.feedback(503, {'Retry-After': '1'}, '', 1)
+    assert not limiter.feedback(503, {'Retry-After': '1'}, '', 2)
+    assert not limiter.feedback(500, {}, '', 0)
+
+
+def test_rate_limiter_waits_for_an_exhausted_quota():
+    clock = Clock()
+    limiter = RateLimiter('test', clock=clock)
+    # a successful response is not sent again but the next request waits for the reset
+    assert not limiter.feedback(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '2.5'}, '', 0)
+    assert limiter.try_acquire() == pytest.approx(2.5)
+
+
+def test_rate_limiter_follows_the_mock_server():
+    server = MockServer(rate_limit=5, burst=2).start()
+    try:
+        limiter = RateLimiter('test', rate=100, burst=10, max_retries=10)
+        statuses = [request('GET', f'{server.url}/test', limiter=limiter).status_code for _ in range(6)]
+    finally:
+        server.stop()
+    assert server.stats['limited'] > 0
+    # every request limited by the server was sent again after its Retry-After
+    assert statuses == [404] * 6
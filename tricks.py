@@ -1,11 +1,18 @@
+import os
 import traceback
 import logging
 import time
-from typing import Optional, Iterable
+import asyncio
+import threading
+import itertools
+import functools
+import concurrent.futures
+from typing import Optional, Iterable, Callable
 
 from watchdog.utils import load_class
 from watchdog.tricks import Trick
 from watchdog.events import (
+    FileSystemEventHandler,
     FileSystemEvent,
     EVENT_TYPE_MOVED,
     EVENT_TYPE_CREATED,
@@ -15,6 +22,15 @@ from watchdog.events import (
     EVENT_TYPE_OPENED
 )
 
+try:
+    from dispatchers import ConduitQueue, Debouncer, AsyncEngine, EventJournal
+    from utils import PathMatcher
+    from metrics import METRICS
+except:
+    from .dispatchers import ConduitQueue, Debouncer, AsyncEngine, EventJournal
+    from .utils import PathMatcher
+    from .metrics import METRICS
+
 
 logger = logging.getLogger(__name__)
 EVENTS = [
@@ -29,15 +45,44 @@ EVENTS = [
 
 class TrickBase(Trick):
 
+    _ids = itertools.count()
+
     def __init__(self, patterns: Optional[Iterable] = None,
                  ignore_patterns: Optional[Iterable] = None,
                  ignore_directories: Optional[bool] = False,
                  case_sensitive: Optional[bool] = False,
                  conduits: Optional[Iterable] = None,
-                 event_interval: Optional[int] = 0) -> None:
+                 event_interval: Optional[int] = 0,
+                 async_dispatch: Optional[bool] = False,
+                 async_workers: Optional[int] = 16,
+                 async_max_pending: Optional[int] = 1000,
+                 journal: Optional[dict] = None,
+                 name: Optional[str] = None) -> None:
         super(TrickBase, self).__init__(patterns, ignore_patterns, ignore_directories, case_sensitive)
+        # a stable label of the metrics, most tricks share the same class
+        self.name = name or f'{type(self).__name__}#{next(self._ids)}'
+        self.matcher = PathMatcher(patterns, ignore_patterns, case_sensitive)
         self.conduits = []
         self.event_interval = event_interval
+        if journal and async_dispatch:
+            # the conduits already read the journal on their own threads
+            logger.warning(f'async_dispatch is ignored with journal: {journal.get("path")!r}')
+            async_dispatch = False
+        # hand events to the event loop and deliver them to the conduits of the same priority at once
+        self.async_dispatch = async_dispatch
+        self.engine = AsyncEngine.acquire(async_workers) if async_dispatch else None
+        self._pending_slots = threading.BoundedSemaphore(max(int(async_max_pending), 1))
+        self._pending_futures = set()
+        # conduit -> its last delivery on the event loop, the next one waits for it to keep the order of the events
+        self._last_deliveries: dict = {}
+        if async_dispatch:
+            METRICS.gauge('watcher_async_pending', self._pending_futures.__len__, trick=self.name)
+        # conduit -> conduit.flow timed and run on this thread, built once
+        self.flows = {}
+        # conduit -> callable that receives the event instead of conduit.flow
+        self.pipelines = {}
+        # upstream stages come first so that they are flushed into the downstream ones on stop
+        self.stages = []
         if conduits:
             for conduit in conduits:
                 try:
@@ -54,28 +99,152 @@ class TrickBase(Trick):
                         logger.error(f'{event} not in {EVENTS}')
                         continue
                 priority = int(conduit.pop('priority', 0))
+                stages = {
+                    'debounce': conduit.pop('debounce', None),
+                    'queue': conduit.pop('queue', None),
+                }
                 try:
                     conduit_cls = load_class(_class)
                     conduit_ins = conduit_cls(name, events, priority, **conduit)
+                    self.build_pipeline(conduit_ins, **stages)
                     self.conduits.append(conduit_ins)
                 except Exception as e:
                     logger.error(f'Could not initiate: {name} {_class}')
                     logger.error(traceback.format_exc())
                     continue
             self.conduits.sort(key=lambda x : x.priority, reverse=True)
+        # events are written to the journal and each conduit reads them on its own thread
+        self.journal = None
+        if journal:
+            # the offset would move on once these stages hold the event in memory, not once it is delivered
+            held = [stage.name for stage in self.stages if isinstance(stage, Debouncer)]
+            held.extend(conduit.name for conduit in self.conduits if getattr(conduit, 'batcher', None))
+            if held:
+                self.stop()
+                raise ValueError(f'journal cannot be used with debounce, batch_window or scan_window: {held}')
+            self.journal = EventJournal(**journal)
+            for conduit in self.conduits:
+                conduit.use_default_rate_limit()
+                # a failed request has to raise so that the journal retries the event before moving on
+                conduit.raise_errors = True
+                self.journal.subscribe(conduit.name, self.pipelines.get(conduit) or self.flows[conduit], conduit.events)
+
+    def dispatch(self, event: FileSystemEvent) -> None:
+        '''override: match the paths with the compiled patterns'''
+        if self.ignore_directories and event.is_directory:
+            return
+        paths = (event.dest_path, event.src_path) if event.dest_path else (event.src_path,)
+        if self.matcher.match_any(os.fsdecode(path) for path in paths if path):
+            FileSystemEventHandler.dispatch(self, event)
 
     def on_any_event(self, event: FileSystemEvent) -> None:
+        METRICS.inc('watcher_events_total', trick=self.name, event_type=event.event_type)
         event_dict = self.event_to_dict(event)
+        if self.journal:
+            # every conduit reads the journal on its own thread
+            self.journal.append(event_dict)
+            return
+        if self.async_dispatch:
+            self._pending_slots.acquire()
+            future = self.engine.submit(self.fan_out(event_dict))
+            self._pending_futures.add(future)
+            future.add_done_callback(self._done)
+        else:
+            for conduit in self.conduits:
+                if event_dict['event_type'] not in conduit.events:
+                    continue
+                try:
+                    (self.pipelines.get(conduit) or self.flows[conduit])(event_dict)
+                except Exception:
+                    logger.error(traceback.format_exc())
+                    continue
+        # sleep between events unless every conduit has its own queue paced by its interval or rate_limit
+        if self.event_interval and any(
+            event_dict['event_type'] in conduit.events and conduit not in self.pipelines for conduit in self.conduits
+        ):
+            time.sleep(self.event_interval)
+
+    async def fan_out(self, event: dict) -> None:
+        # every delivery is chained before the first await, so each conduit gets the events in the order they were submitted
+        deliveries = []
+        higher: list[asyncio.Task] = []
+        for _, group in itertools.groupby(self.conduits, key=lambda x: x.priority):
+            tasks = []
+            for conduit in group:
+                if event['event_type'] not in conduit.events:
+                    continue
+                # conduits of a higher priority still go first
+                after = [*higher, self._last_deliveries[conduit]] if conduit in self._last_deliveries else higher
+                task = asyncio.ensure_future(self.deliver(conduit, event, after))
+                task.add_done_callback(functools.partial(self._delivered, conduit))
+                self._last_deliveries[conduit] = task
+                tasks.append(task)
+            higher = tasks or higher
+            deliveries.extend(tasks)
+        if deliveries:
+            await asyncio.wait(deliveries)
+
+    def _delivered(self, conduit, task: asyncio.Task) -> None:
+        if self._last_deliveries.get(conduit) is task:
+            del self._last_deliveries[conduit]
+
+    async def deliver(self, conduit, event: dict, after: Iterable[asyncio.Task] = ()) -> None:
+        if after:
+            await asyncio.wait(after)
+        try:
+            target = self.pipelines.get(conduit)
+            if target:
+                await self.engine.run_sync(target, event)
+            elif asyncio.iscoroutinefunction(conduit.flow):
+                with METRICS.timer('watcher_conduit_flow_seconds', 'watcher_conduit_errors_total', conduit=conduit.name):
+                    await conduit.flow(event)
+            else:
+                await self.engine.run_sync(self.flows[conduit], event)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def _done(self, future: concurrent.futures.Future) -> None:
+        self._pending_futures.discard(future)
+        self._pending_slots.release()
+
+    def sync_flow(self, conduit) -> Callable[[dict], None]:
+        if not asyncio.iscoroutinefunction(conduit.flow):
+            flow = conduit.flow
+        else:
+            if not self.engine:
+                self.engine = AsyncEngine.acquire()
+            flow = lambda event: self.engine.submit(conduit.flow(event)).result()
+        return METRICS.timed(flow, 'watcher_conduit_flow_seconds', 'watcher_conduit_errors_total', conduit=conduit.name)
+
+    def stop(self) -> None:
+        if self.journal:
+            self.journal.stop()
+        if self._pending_futures:
+            concurrent.futures.wait(list(self._pending_futures))
+        for stage in self.stages:
+            stage.stop()
         for conduit in self.conduits:
-            if event_dict['event_type'] not in conduit.events:
-                continue
-            try:
-                conduit.flow(event_dict)
-            except Exception:
-                logger.error(traceback.format_exc())
-                continue
-        # sleep between events
-        time.sleep(self.event_interval)
+            conduit.stop()
+        if self.engine:
+            AsyncEngine.release()
+            self.engine = None
+
+    def build_pipeline(self, conduit, debounce: Optional[dict] = None, queue: Optional[dict] = None) -> None:
+        # debounce -> queue -> conduit.flow
+        target = self.flows[conduit] = self.sync_flow(conduit)
+        stages = []
+        if queue:
+            conduit.use_default_rate_limit()
+            stage = ConduitQueue(conduit.name, target, **(queue if isinstance(queue, dict) else {}))
+            stages.insert(0, stage)
+            target = stage.put
+        if debounce:
+            stage = Debouncer(conduit.name, target, **(debounce if isinstance(debounce, dict) else {}))
+            stages.insert(0, stage)
+            target = stage.put
+        if stages:
+            self.stages.extend(stages)
+            self.pipelines[conduit] = target
 
     def event_to_dict(self, event: FileSystemEvent) -> dict[str, str]:
         return {
@@ -1,5 +1,7 @@
 import traceback
 import logging
+import asyncio
+import json
 import functools
 import threading
 import re
@@ -7,8 +9,16 @@ import subprocess
 import sys
 import os
 import errno
+import struct
+import time
+import collections
+import itertools
+import datetime
+import email.utils
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from stat import S_ISDIR
-from typing import Any, Optional, Union, Iterable, Callable, Tuple, Iterator
+from typing import Any, Optional, Union, Iterable, Callable, Tuple, Iterator, NamedTuple
 from logging.config import dictConfig
 
 from watchdog.utils.dirsnapshot import DirectorySnapshot
@@ -19,6 +29,12 @@ except:
     subprocess.check_call([sys.executable, '-m', 'pip', 'install', '-U', 'requests'])
 
 import requests
+import requests.adapters
+
+try:
+    from metrics import METRICS
+except:
+    from .metrics import METRICS
 
 
 logger = logging.getLogger(__name__)
@@ -59,32 +75,115 @@ class SimpleDirectorySnapShot(DirectorySnapshot):
         stat: Callable[[str], os.stat_result] = os.stat,
         listdir: Callable[[Optional[str]], Iterator[os.DirEntry]] = os.scandir,
         stopped_event: threading.Event = None,
+        previous: Optional[DirectorySnapshot] = None,
+        use_direntry: bool = False,
+        walk_workers: int = 1,
+        prune: Optional[Callable[[str], bool]] = None,
+        prune_below: Optional[Callable[[str], bool]] = None,
     ):
         self.recursive = recursive
         self.stat = stat
         self.listdir = listdir
+        # take stat results of the DirEntry objects from listdir instead of calling stat() again
+        self.use_direntry = use_direntry
+        # list sibling directories at the same time on high latency file systems
+        self.walk_workers = walk_workers
+        # entries for which prune() is true are not stat'ed and directories for which prune_below() is true are not listed
+        self.prune = prune
+        self.prune_below = prune_below
         self._stopped_event = stopped_event
+        self.taken_at = time.time()
+        # incremental mode: directories not changed since the previous snapshot are not listed again
+        self.previous = previous
+        self._previous_children = children_index(previous._stat_info) if previous else {}
+        self.listed = 0
+        self.carried = 0
+        self.pruned = 0
+        # the counters are updated by the threads of walk_parallel
+        self._count_lock = threading.Lock()
 
         self._stat_info: dict[str, os.stat_result] = {}
         self._inode_to_path: dict[Tuple[int, int], str] = {}
 
         st = self.stat(path)
-        self._stat_info[path] = st
-        self._inode_to_path[(st.st_ino, st.st_dev)] = path
+        self.add(path, st)
 
-        for p, st in self.walk(path):
+        walk = self.walk_parallel if self.walk_workers > 1 else self.walk
+        for p, st in walk(path, st):
             if not self.should_keep_running: break
-            i = (st.st_ino, st.st_dev)
-            self._inode_to_path[i] = p
-            self._stat_info[p] = st
+            self.add(p, st)
+        # an interrupted walk leaves a partial snapshot behind
+        self.completed = self.should_keep_running
+        # do not chain every snapshot taken so far
+        self.incremental = previous is not None
+        self.previous = None
+        self._previous_children = {}
+
+    def add(self, path: str, st: os.stat_result) -> None:
+        self._inode_to_path[(st.st_ino, st.st_dev)] = path
+        self._stat_info[path] = st
 
     @property
     def should_keep_running(self):
-        return not self._stopped_event.is_set()
+        return not (self._stopped_event and self._stopped_event.is_set())
 
-    def walk(self, root: str) -> Iterator[Tuple[str, os.stat_result]]:
+    def walk(self, root: str, root_stat: Optional[os.stat_result] = None) -> Iterator[Tuple[str, os.stat_result]]:
         if not self.should_keep_running: return
+        entries = self.scan(root, root_stat)
+        for entry in entries:
+            if not self.should_keep_running: break
+            yield entry
+
+        if self.recursive:
+            for path, st in entries:
+                if not self.should_keep_running: break
+                try:
+                    if self.should_descend(path, st):
+                        for entry in self.walk(path, st):
+                            if not self.should_keep_running: break
+                            yield entry
+                except PermissionError:
+                    pass
+
+    def walk_parallel(self, root: str, root_stat: Optional[os.stat_result] = None) -> Iterator[Tuple[str, os.stat_result]]:
+        executor = ThreadPoolExecutor(max_workers=self.walk_workers, thread_name_prefix='walker')
+        try:
+            pending = {executor.submit(self.scan, root, root_stat)}
+            while pending and self.should_keep_running:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        entries = future.result()
+                    except PermissionError:
+                        continue
+                    for path, st in entries:
+                        if not self.should_keep_running: return
+                        yield path, st
+                        if self.recursive and self.should_descend(path, st):
+                            pending.add(executor.submit(self.scan, path, st))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def should_descend(self, path: str, st: os.stat_result) -> bool:
+        if not S_ISDIR(st.st_mode):
+            return False
+        if self.prune_below and self.prune_below(path):
+            self.count('pruned')
+            return False
+        return True
+
+    def is_pruned(self, path: str) -> bool:
+        if self.prune and self.prune(path):
+            self.count('pruned')
+            return True
+        return False
+
+    def scan(self, root: str, root_stat: Optional[os.stat_result] = None) -> list[Tuple[str, os.stat_result]]:
+        if self.is_unchanged(root, root_stat):
+            return self.carry_over(root)
         try:
+            if self.use_direntry:
+                return self.scan_direntry(root)
             paths = [os.path.join(root, entry.name) for entry in self.listdir(root)]
         except OSError as e:
             # Directory may have been deleted between finding it in the directory
@@ -92,30 +191,378 @@ class SimpleDirectorySnapShot(DirectorySnapshot):
             # happens we treat it as empty. Likewise if the directory was replaced
             # with a file of the same name (less likely, but possible).
             if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EINVAL):
-                return
+                return []
             else:
                 raise
+        self.count('listed')
 
         entries = []
         for p in paths:
             if not self.should_keep_running: break
+            if self.is_pruned(p): continue
             try:
-                entry = (p, self.stat(p))
-                entries.append(entry)
-                yield entry
+                entries.append((p, self.stat(p)))
             except OSError:
                 continue
+        return entries
 
-        if self.recursive:
-            for path, st in entries:
-                if not self.should_keep_running: break
+    def scan_direntry(self, root: str) -> list[Tuple[str, os.stat_result]]:
+        entries = []
+        for entry in self.listdir(root):
+            if not self.should_keep_running: break
+            if self.is_pruned(entry.path): continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+                # DirEntry on Windows has no inode numbers
+                if not st.st_ino:
+                    st = self.stat(entry.path)
+                entries.append((entry.path, st))
+            except OSError:
+                continue
+        self.count('listed')
+        return entries
+
+    def count(self, name: str) -> None:
+        with self._count_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def is_unchanged(self, root: str, root_stat: Optional[os.stat_result]) -> bool:
+        if not self.previous or not root_stat:
+            return False
+        try:
+            old = self.previous.stat_info(root)
+        except KeyError:
+            return False
+        # a directory modified right before the previous snapshot could be changed again within the same mtime
+        return (old.st_ino, old.st_dev, old.st_mtime, old.st_ctime) == \
+               (root_stat.st_ino, root_stat.st_dev, root_stat.st_mtime, root_stat.st_ctime) and \
+               root_stat.st_mtime < self.previous.taken_at - 1
+
+    def carry_over(self, root: str) -> list[Tuple[str, os.stat_result]]:
+        self.count('carried')
+        entries = []
+        for p in self._previous_children.get(root, ()):
+            if not self.should_keep_running: break
+            if self.is_pruned(p): continue
+            st = self.previous.stat_info(p)
+            if S_ISDIR(st.st_mode):
+                # changes inside a subdirectory do not touch the mtime of its parent
                 try:
-                    if S_ISDIR(st.st_mode):
-                        for entry in self.walk(path):
-                            if not self.should_keep_running: break
-                            yield entry
-                except PermissionError:
-                    pass
+                    st = self.stat(p)
+                except OSError:
+                    continue
+            entries.append((p, st))
+        return entries
+
+
+class SnapshotStat(NamedTuple):
+    st_ino: int
+    st_dev: int
+    st_mtime: float
+    st_size: int
+    st_mode: int
+    st_ctime: float
+
+
+class StoredDirectorySnapShot(DirectorySnapshot):
+    '''
+    A snapshot restored from the file written by StoredDirectorySnapShot.dump()
+
+    header: magic, recursive, taken at, length of the root path, root path
+    record: inode, device, mtime, size, mode, ctime, length of the path, path relative to the root
+    '''
+
+    MAGIC = b'WSTSNAP2'
+    # compared by path on the first poll, the inodes may have been numbered again since it was saved
+    stored = True
+    HEADER = struct.Struct('<8s?dI')
+    RECORD = struct.Struct('<QQdqIdI')
+
+    def __init__(self, file: str) -> None:
+        self.completed = True
+        self._stat_info: dict[str, SnapshotStat] = {}
+        self._inode_to_path: dict[Tuple[int, int], str] = {}
+        with open(file, 'rb') as f:
+            data = f.read()
+        magic, self.recursive, self.taken_at, length = self.HEADER.unpack_from(data, 0)
+        if not magic == self.MAGIC:
+            raise ValueError(f'Not a snapshot file: {file!r}')
+        offset = self.HEADER.size
+        self.root = os.fsdecode(data[offset:offset + length])
+        offset += length
+        while offset < len(data):
+            ino, dev, mtime, size, mode, ctime, length = self.RECORD.unpack_from(data, offset)
+            offset += self.RECORD.size
+            relative = os.fsdecode(data[offset:offset + length])
+            offset += length
+            path = os.path.join(self.root, relative) if relative else self.root
+            self._stat_info[path] = SnapshotStat(ino, dev, mtime, size, mode, ctime)
+            self._inode_to_path[(ino, dev)] = path
+
+    @classmethod
+    def dump(cls, snapshot: DirectorySnapshot, file: str, root: str, recursive: bool) -> int:
+        '''write the snapshot atomically and return the number of records'''
+        prefix = len(os.path.join(root, ''))
+        encoded_root = os.fsencode(root)
+        taken_at = getattr(snapshot, 'taken_at', time.time())
+        chunks = [cls.HEADER.pack(cls.MAGIC, recursive, taken_at, len(encoded_root)), encoded_root]
+        for path, st in snapshot._stat_info.items():
+            relative = os.fsencode(path[prefix:] if not path == root else '')
+            chunks.append(cls.RECORD.pack(st.st_ino, st.st_dev, st.st_mtime, st.st_size, st.st_mode, st.st_ctime, len(relative)))
+            chunks.append(relative)
+        temp = f'{file}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(b''.join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, file)
+        return len(snapshot._stat_info)
+
+
+class TTLCache:
+    '''LRU cache whose entries expire after ttl seconds, ttl=0 disables it'''
+
+    def __init__(self, maxsize: int = 1024, ttl: Union[int, float] = 60) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        if not self.ttl or not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class PathTrie:
+    '''map path prefixes to values and look them up by path components'''
+
+    VALUE = object()
+
+    def __init__(self) -> None:
+        self._root: dict = {}
+        self._count = 0
+
+    @staticmethod
+    def split(path: str) -> list[str]:
+        return [part for part in path.replace('\\', '/').split('/') if part]
+
+    def setdefault(self, path: str, value: Any) -> Any:
+        node = self._root
+        for part in self.split(path):
+            node = node.setdefault(part, {})
+        if self.VALUE not in node:
+            node[self.VALUE] = value
+            self._count += 1
+        return node[self.VALUE]
+
+    def longest_prefix(self, path: str, default: Any = None) -> Any:
+        node = self._root
+        found = node.get(self.VALUE, default)
+        for part in self.split(path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(self.VALUE, found)
+        return found
+
+    def first_below(self, path: str, default: Any = None) -> Any:
+        '''a value of the path itself or of one of its descendants'''
+        node = self._root
+        for part in self.split(path):
+            node = node.get(part)
+            if node is None:
+                return default
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.VALUE in node:
+                return node[self.VALUE]
+            stack.extend(reversed([child for key, child in node.items() if key is not self.VALUE]))
+        return default
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class PatternSet:
+    '''
+    Glob patterns with the semantics of pathlib.PurePath.match() compiled into one regex
+
+    "*.ext" patterns are looked up in a set of extensions and "*" matches every path without a regex.
+    '''
+
+    def __init__(self, patterns: Iterable[str], case_sensitive: bool = True) -> None:
+        self.case_sensitive = case_sensitive
+        self.patterns = [self.fold(pattern) for pattern in patterns]
+        self.everything = False
+        self.extensions: set[str] = set()
+        regexes = []
+        for pattern in self.patterns:
+            if not pattern:
+                raise ValueError('empty pattern')
+            if pattern == '*':
+                self.everything = True
+            elif pattern.startswith('*.') and not any(c in pattern[2:] for c in '*?[./'):
+                self.extensions.add(pattern[2:])
+            else:
+                regexes.append(self.translate(pattern))
+        self.regex = re.compile('|'.join(regexes), re.DOTALL) if regexes else None
+
+    def fold(self, path: str) -> str:
+        # PureWindowsPath is used for case-insensitive matching by watchdog
+        return path if self.case_sensitive else path.replace('\\', '/').lower()
+
+    @staticmethod
+    def translate(pattern: str) -> str:
+        parts = [part for part in pattern.split('/') if part and part != '.']
+        if not parts:
+            raise ValueError(f'invalid pattern: {pattern!r}')
+        regex = '/'.join(PatternSet.translate_part(part) for part in parts)
+        # absolute patterns match the whole path, relative ones match from the right
+        return f'(?:^/{regex}$)' if pattern.startswith('/') else f'(?:(?:^|/){regex}$)'
+
+    @staticmethod
+    def translate_part(part: str) -> str:
+        i, n, regex = 0, len(part), []
+        while i < n:
+            c = part[i]
+            i += 1
+            if c == '*':
+                regex.append('[^/]*')
+            elif c == '?':
+                regex.append('[^/]')
+            elif c == '[':
+                j = i
+                if j < n and part[j] == '!':
+                    j += 1
+                if j < n and part[j] == ']':
+                    j += 1
+                while j < n and part[j] != ']':
+                    j += 1
+                if j >= n:
+                    regex.append('\\[')
+                    continue
+                chars = part[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if chars.startswith('!'):
+                    regex.append(f'[^/{chars[1:]}]')
+                elif chars.startswith('^') or chars.startswith('['):
+                    regex.append(f'[\\{chars}]')
+                else:
+                    regex.append(f'[{chars}]')
+            else:
+                regex.append(re.escape(c))
+        return ''.join(regex)
+
+    def __call__(self, path: str) -> bool:
+        '''path must be folded already'''
+        path = path.rstrip('/')
+        if not path:
+            return False
+        if self.everything:
+            return True
+        if self.extensions:
+            name = path.rpartition('/')[2]
+            head, dot, ext = name.rpartition('.')
+            if dot and ext in self.extensions:
+                return True
+        return bool(self.regex and self.regex.search(path))
+
+
+class PathMatcher:
+    '''a drop-in for watchdog.utils.patterns.match_any_paths() that compiles the patterns once'''
+
+    def __init__(self, patterns: Optional[Iterable[str]] = None, ignore_patterns: Optional[Iterable[str]] = None, case_sensitive: bool = True) -> None:
+        self.included = PatternSet(['*'] if patterns is None else patterns, case_sensitive)
+        self.excluded = PatternSet(ignore_patterns or [], case_sensitive)
+        self.excluded_parents = PatternSet(
+            [pattern[:-2] for pattern in self.excluded.patterns if pattern.endswith('/*') and pattern[:-2].strip('/')],
+            case_sensitive,
+        )
+        conflicts = set(self.included.patterns) & set(self.excluded.patterns)
+        if conflicts:
+            raise ValueError(f'conflicting patterns `{conflicts}` included and excluded')
+
+    def match(self, path: str) -> bool:
+        path = self.included.fold(path)
+        return self.included(path) and not self.excluded(path)
+
+    def match_any(self, paths: Iterable[str]) -> bool:
+        return any(self.match(path) for path in paths)
+
+    def ignores(self, path: str) -> bool:
+        '''whether the path matches one of the ignore patterns, the polling walker can skip such directories'''
+        return self.excluded(self.excluded.fold(path))
+
+    def ignores_below(self, path: str) -> bool:
+        '''whether every child of the directory matches an ignore pattern like "*/@eaDir/*"'''
+        return self.excluded_parents(self.excluded.fold(path))
+
+
+def children_index(stat_info: dict[str, Any]) -> dict[str, list[str]]:
+    index: dict[str, list[str]] = {}
+    for path in stat_info:
+        index.setdefault(os.path.dirname(path), []).append(path)
+    return index
+
+
+def read_mounts(file: str = '/proc/self/mountinfo') -> list[Tuple[str, str]]:
+    '''(mount point, file system type) of each mount, the longest mount point first'''
+    mounts = []
+    try:
+        with open(file) as f:
+            for line in f:
+                # id parent major:minor root mount-point options [optional fields...] - type source super-options
+                fields = line.split()
+                try:
+                    separator = fields.index('-', 6)
+                except ValueError:
+                    continue
+                mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[4])
+                mounts.append((mount_point, fields[separator + 1]))
+    except OSError:
+        return []
+    # a later mount on the same mount point hides the earlier ones
+    mounts.reverse()
+    mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return mounts
+
+
+def get_fstype(path: str, mounts: Optional[list[Tuple[str, str]]] = None) -> Optional[str]:
+    path = os.path.realpath(path)
+    for mount_point, fstype in read_mounts() if mounts is None else mounts:
+        if path == mount_point or path.startswith(os.path.join(mount_point, '')):
+            return fstype
+    return None
 
 
 def set_logger(log_config: dict) -> None:
@@ -131,21 +578,293 @@ def set_logger(log_config: dict) -> None:
     logger.info('logging config is loaded.')
 
 
-def request(method: str, url: str, data: Optional[dict] = None, timeout: Union[int, tuple, None] = None, **kwds: dict) -> requests.Response:
+class SessionPool:
+    '''keep-alive sessions per host shared by every conduit'''
+
+    def __init__(self, pool_maxsize: int = 10, timeout: Union[int, float, tuple, list] = (5, 60), hosts: Optional[dict] = None) -> None:
+        self._sessions: dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self.configure(pool_maxsize, timeout, hosts)
+
+    def configure(self, pool_maxsize: int = 10, timeout: Union[int, float, tuple, list] = (5, 60), hosts: Optional[dict] = None) -> None:
+        '''hosts: {'plex:32400': {'pool_maxsize': 4, 'timeout': 30}}'''
+        with self._lock:
+            self.pool_maxsize = pool_maxsize
+            self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+            self.hosts = hosts or {}
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def host_options(self, host: str) -> dict:
+        options = {'pool_maxsize': self.pool_maxsize, 'timeout': self.timeout}
+        options.update(self.hosts.get(host) or {})
+        if isinstance(options['timeout'], list):
+            options['timeout'] = tuple(options['timeout'])
+        return options
+
+    def get(self, url: str) -> tuple[requests.Session, Union[int, float, tuple]]:
+        host = urllib.parse.urlsplit(url).netloc
+        options = self.host_options(host)
+        with self._lock:
+            session = self._sessions.get(host)
+            if not session:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=options['pool_maxsize'])
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+        return session, options['timeout']
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        '''connections opened and requests sent per host'''
+        result = {}
+        with self._lock:
+            for host, session in self._sessions.items():
+                stats = result.setdefault(host, {'connections': 0, 'requests': 0})
+                for adapter in set(session.adapters.values()):
+                    for key in adapter.poolmanager.pools.keys():
+                        pool = adapter.poolmanager.pools[key]
+                        stats['connections'] += pool.num_connections
+                        stats['requests'] += pool.num_requests
+        return result
+
+
+SESSIONS = SessionPool()
+
+
+class RateLimiter:
+    '''
+    A token bucket and a cap on the requests in flight for one service
+
+    A response with a status in statuses pauses every request until its Retry-After and is sent again up to
+    max_retries times. An exhausted quota (X-RateLimit-Remaining: 0) pauses until X-RateLimit-Reset-After.
+    '''
+
+    def __init__(self, name: str,
+                 rate: Union[int, float] = 0,
+                 burst: Optional[int] = None,
+                 max_in_flight: int = 0,
+                 max_retries: int = 3,
+                 retry_base: Union[int, float] = 1,
+                 retry_max: Union[int, float] = 60,
+                 statuses: Iterable[int] = (429, 503),
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.statuses = set(statuses)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._refilled_at = clock()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> Optional[float]:
+        '''0 if a request may be sent now, otherwise the seconds to wait or None until one in flight ends'''
+        with self._condition:
+            now = self.clock()
+            if self.rate:
+                self._tokens = min(self._tokens + (now - self._refilled_at) * self.rate, self.burst)
+                self._refilled_at = now
+            if self._paused_until > now:
+                return self._paused_until - now
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                return None
+            if self.rate and self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            if self.rate:
+                self._tokens -= 1
+            self._in_flight += 1
+            return 0
+
+    def acquire(self) -> None:
+        start = self.clock()
+        while (wait := self.try_acquire()) != 0:
+            with self._condition:
+                self._condition.wait(wait)
+        self.throttled(self.clock() - start)
+
+    async def acquire_async(self) -> None:
+        start = self.clock()
+        while (wait := self.try_acquire()) != 0:
+            await asyncio.sleep(0.01 if wait is None else wait)
+        self.throttled(self.clock() - start)
+
+    def throttled(self, seconds: float) -> None:
+        if seconds > 0.001:
+            METRICS.inc('watcher_conduit_throttled_seconds_total', seconds, conduit=self.name)
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def retry_after(self, headers: Any, content: str) -> Optional[float]:
+        value = headers.get('Retry-After')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+            try:
+                return (email.utils.parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+        try:
+            # discord: {"message": "You are being rate limited.", "retry_after": 0.5, "global": false}
+            return float(json.loads(content)['retry_after'])
+        except Exception:
+            return None
+
+    def feedback(self, status_code: int, headers: Any, content: str, attempt: int) -> bool:
+        '''pause on a rate limit response and tell whether to send the request again'''
+        limited = status_code in self.statuses
+        delay = None
+        if limited:
+            delay = self.retry_after(headers, content)
+            if delay is None:
+                delay = self.retry_base * 2 ** attempt
+            METRICS.inc('watcher_conduit_limited_total', conduit=self.name)
+        elif headers.get('X-RateLimit-Remaining') == '0':
+            try:
+                delay = float(headers.get('X-RateLimit-Reset-After') or 0)
+            except ValueError:
+                delay = None
+        if delay and delay > 0:
+            delay = min(delay, self.retry_max)
+            with self._condition:
+                self._paused_until = max(self._paused_until, self.clock() + delay)
+            if limited:
+                logger.warning(f'{self.name}: {status_code}, pausing for {delay:.1f}s (attempt {attempt + 1})')
+        return limited and attempt < self.max_retries
+
+
+class ResponseError(Exception):
+    '''a request that could not be sent or got a status of 400 or more'''
+
+    def __init__(self, url: str, status_code: int, content: str) -> None:
+        super(ResponseError, self).__init__(f'{status_code} {url}: {content.strip()[:200]}')
+        self.url = url
+        self.status_code = status_code
+
+
+def request(method: str, url: str, data: Optional[dict] = None, timeout: Union[int, tuple, None] = None,
+            limiter: Optional[RateLimiter] = None, raise_errors: bool = False, **kwds: dict) -> requests.Response:
+    if limiter:
+        for attempt in itertools.count():
+            limiter.acquire()
+            try:
+                response = request(method, url, data, timeout, **kwds)
+            finally:
+                limiter.release()
+            if not limiter.feedback(response.status_code, response.headers, response.text, attempt):
+                break
+    else:
+        response = send(method, url, data, timeout, **kwds)
+    if raise_errors and not 0 < response.status_code < 400:
+        raise ResponseError(url, response.status_code, response.text)
+    return response
+
+
+def send(method: str, url: str, data: Optional[dict] = None, timeout: Union[int, tuple, None] = None, **kwds: dict) -> requests.Response:
+    '''a failed request is logged and returned as a response of status 0'''
     try:
+        session, default_timeout = SESSIONS.get(url)
+        timeout = timeout or default_timeout
         if method.upper() == 'JSON':
-            return requests.request('POST', url, json=data or {}, timeout=timeout, **kwds)
+            response = session.request('POST', url, json=data or {}, timeout=timeout, **kwds)
         else:
-            return requests.request(method, url, data=data, timeout=timeout, **kwds)
+            response = session.request(method, url, data=data, timeout=timeout, **kwds)
+        if response.status_code >= 400:
+            METRICS.inc('watcher_http_errors_total', host=urllib.parse.urlsplit(url).netloc)
+        return response
     except:
         tb = traceback.format_exc()
         logger.error(tb)
+        METRICS.inc('watcher_http_errors_total', host=urllib.parse.urlsplit(url).netloc)
         response = requests.Response()
         response._content = bytes(tb, 'utf-8')
         response.status_code = 0
         return response
 
 
+def import_aiohttp() -> Any:
+    try:
+        return __import__('aiohttp')
+    except ImportError:
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', '-U', 'aiohttp'])
+        return __import__('aiohttp')
+
+
+# event loop -> host -> aiohttp.ClientSession
+ASYNC_SESSIONS: dict = {}
+
+
+async def async_request(method: str, url: str, data: Optional[dict] = None, timeout: Union[int, tuple, None] = None,
+                        limiter: Optional[RateLimiter] = None, raise_errors: bool = False, **kwds: dict) -> dict[str, Any]:
+    '''non-blocking request() that returns the parsed result of parse_json_response()'''
+    aiohttp = import_aiohttp()
+    host = urllib.parse.urlsplit(url).netloc
+    options = SESSIONS.host_options(host)
+    # one session per host like SESSIONS so that its pool_maxsize applies
+    sessions = ASYNC_SESSIONS.setdefault(asyncio.get_running_loop(), {})
+    session = sessions.get(host)
+    if session is None:
+        session = sessions[host] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=options['pool_maxsize']))
+    timeout = timeout or options['timeout']
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    if isinstance(kwds.get('auth'), tuple):
+        kwds['auth'] = aiohttp.BasicAuth(*kwds['auth'])
+    if method.upper() == 'JSON':
+        method = 'POST'
+        kwds['json'] = data or {}
+    else:
+        kwds['data'] = data
+    for attempt in itertools.count():
+        if limiter:
+            await limiter.acquire_async()
+        headers = {}
+        try:
+            async with session.request(method, url, timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read), **kwds) as response:
+                content = await response.text()
+                status_code = response.status
+                headers = response.headers
+        except:
+            tb = traceback.format_exc()
+            logger.error(tb)
+            content = tb
+            status_code = 0
+        finally:
+            if limiter:
+                limiter.release()
+        if not 0 < status_code < 400:
+            METRICS.inc('watcher_http_errors_total', host=host)
+        if not limiter or not limiter.feedback(status_code, headers, content, attempt):
+            break
+    if raise_errors and not 0 < status_code < 400:
+        raise ResponseError(url, status_code, content)
+    try:
+        return json.loads(content)
+    except Exception as e:
+        return {
+            'status_code': status_code,
+            'content': content.strip(),
+            'exception': f'{repr(e)}',
+        }
+
+
+async def close_async_sessions() -> None:
+    sessions = ASYNC_SESSIONS.pop(asyncio.get_running_loop(), {})
+    for session in sessions.values():
+        await session.close()
+
+
 def parse_json_response(response: requests.Response) -> dict[str, Any]:
     try:
         result = response.json()
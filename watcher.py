@@ -26,6 +26,7 @@ except:
 import yaml
 from watchdog.observers.api import BaseObserver, BaseObserverSubclassCallable
 from watchdog.utils import WatchdogShutdown, load_class
+from watchdog.events import FileSystemEventHandler
 from watchdog.watchmedo import (
     argument,
     command,
@@ -37,7 +38,10 @@ from watchdog.watchmedo import (
     HelpFormatter
 )
 
-from utils import set_logger
+from utils import set_logger, SESSIONS
+from metrics import METRICS
+from observers import SimplePollingObserver
+from tricks import TrickBase
 
 
 '''from watchdog.watchmedo'''
@@ -63,16 +67,47 @@ def command(args: list = [], parent: ArgumentParser = subparsers, cmd_aliases: l
     return decorator
 
 
-def schedule_tricks_by_itself(observer: BaseObserver, tricks: Iterable, dir_path: str) -> None:
-    for trick in tricks:
+def build_trick(name: str, value: dict, label: str) -> FileSystemEventHandler:
+    TrickClass = load_class(name)
+    if issubclass(TrickClass, TrickBase):
+        # the position in the tricks file labels the metrics unless a name is given
+        value.setdefault('name', label)
+    return TrickClass(**value)
+
+
+def schedule_tricks_by_itself(observer: BaseObserver, tricks: Iterable, dir_path: str, file_name: str = '') -> list:
+    handlers = []
+    for index, trick in enumerate(tricks):
         for name, value in list(trick.items()):
             dirs = value.pop('dirs', [dir_path])
             recursive = value.pop('recursive', False)
-            TrickClass = load_class(name)
-            handler = TrickClass(**value)
+            handler = build_trick(name, value, f'{file_name}#{index}')
+            handlers.append(handler)
             for dir in dirs:
                 observer.schedule(handler, dir, recursive)
                 logger.info(f'Watching: {dir!r}')
+    return handlers
+
+
+def merge_config(key: str, configs: Iterable[tuple[pathlib.Path, dict]]) -> dict:
+    '''merge a block shared by every tricks file, a value set differently in two files is an error'''
+    merged, origins = {}, {}
+
+    def merge(target: dict, block: dict, origin: str, prefix: tuple) -> None:
+        for option, value in block.items():
+            path = (*prefix, option)
+            if isinstance(value, dict) and isinstance(target.get(option, {}), dict):
+                merge(target.setdefault(option, {}), value, origin, path)
+            elif option in target and not target[option] == value:
+                name = '.'.join(map(str, path))
+                raise ValueError(f'{name} is {target[option]!r} in {origins[path]!r} but {value!r} in {origin!r}')
+            else:
+                target[option] = value
+                origins.setdefault(path, origin)
+
+    for tricks_file, config in configs:
+        merge(merged, config.get(key) or {}, tricks_file.name, (key,))
+    return merged
 
 
 def get_observer(force_observer: Optional[str] = None) -> BaseObserverSubclassCallable:
@@ -81,6 +116,8 @@ def get_observer(force_observer: Optional[str] = None) -> BaseObserverSubclassCa
         case 'polling':
             #from watchdog.observers.polling import PollingObserver as Observer
             from observers import SimplePollingObserver as Observer
+        case 'hybrid':
+            from observers import HybridObserver as Observer
         case 'kqueue':
             from watchdog.observers.kqueue import KqueueObserver as Observer
         case 'inotify':
@@ -116,12 +153,23 @@ def tricks(args: Namespace) -> None:
     Execute tricks in multiple yaml files.
     """
     observers = []
+    handlers = []
     try:
+        configs = []
         for tricks_file in args.files:
             tricks_file = pathlib.Path(tricks_file)
             if not tricks_file.exists:
                 raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), str(tricks_file))
-            config = load_config(str(tricks_file))
+            configs.append((tricks_file, load_config(str(tricks_file))))
+        # the sessions are shared by the conduits of every file
+        http = merge_config('http', configs)
+        if http:
+            SESSIONS.configure(**http)
+        # before any trick registers its timers and gauges
+        metrics = merge_config('metrics', configs)
+        if metrics:
+            METRICS.configure(**metrics)
+        for tricks_file, config in configs:
             try:
                 tricks = config[CONFIG_KEY_TRICKS]
             except KeyError:
@@ -130,13 +178,18 @@ def tricks(args: Namespace) -> None:
                 add_to_sys_path(config['python_path'])
             force_observer = config.get('observer')
             force_timeout = config.get('timeout', 1)
+            observer_options = config.get('observer_options') or {}
             Observer: BaseObserverSubclassCallable = get_observer(force_observer)
             logger.info(f'{tricks_file.name}: {Observer.__name__}')
-            observer = Observer(force_timeout)
+            # the options of the polling emitters, other observers do not take them
+            if observer_options and not issubclass(Observer, SimplePollingObserver):
+                logger.warning(f'{tricks_file.name}: observer_options are ignored by {Observer.__name__}: {list(observer_options)}')
+                observer_options = {}
+            observer = Observer(force_timeout, **observer_options)
             default_dir = tricks_file.parent.name
             if not default_dir:
                 default_dir = os.path.relpath(os.getcwd())
-            schedule_tricks_by_itself(observer, tricks, default_dir)
+            handlers.extend(schedule_tricks_by_itself(observer, tricks, default_dir, tricks_file.name))
             observers.append(observer)
         for observer in observers:
             observer.start()
@@ -156,9 +209,129 @@ def tricks(args: Namespace) -> None:
         if o.ident:
             logger.debug(f'Join: {o}')
             o.join()
+    for handler in handlers:
+        if hasattr(handler, 'stop'):
+            handler.stop()
+    logger.info(f'HTTP connections: {SESSIONS.stats()}')
+    METRICS.stop()
     logger.debug('Tricks ends.')
 
 
+@command(
+    [
+        argument("path", help="A directory for the generated trees, they are kept for the next run."),
+        argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Entries of each tree."),
+        argument("--fanout", type=int, default=10, help="Subdirectories per directory."),
+        argument("--files-per-dir", type=int, default=100),
+        argument("--depth", type=int, default=0, help="Maximum depth of the trees, 0 is unlimited."),
+        argument("--stat-latency", type=float, default=0, help="Seconds added to every stat() and listdir() of the walk."),
+        argument("--repeat", type=int, default=3),
+        argument("--changes", type=int, default=100, help="Files modified, moved, deleted and created between two snapshots."),
+        argument("--engines", nargs="+", help="Diff engines to compare, all by default."),
+        argument("--events", type=int, default=100_000, help="Events dispatched to the conduits, 0 to skip."),
+        argument("--conduits", type=int, default=5, help="DummyConduits that receive every event."),
+        argument("--async-dispatch", action="store_true"),
+        argument("--output", help="Write the results to this JSON file."),
+        argument("--compare", help="A JSON file of earlier results to compare with."),
+        argument('--log-config', help="A YAML file that include logging configs."),
+    ],
+)
+def bench(args: Namespace) -> None:
+    """
+    Measure the walk, the diff, the peak memory and the dispatch throughput on generated trees.
+    """
+    import json
+    from bench import bench_suite, compare_suites
+    results = bench_suite(
+        args.path, args.sizes, args.fanout, args.files_per_dir, args.depth, args.stat_latency, args.repeat,
+        args.changes, args.engines, args.events, args.conduits, args.async_dispatch,
+    )
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        logger.info(f'Results: {args.output!r}')
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            base = json.load(file)
+        for line in compare_suites(base, results):
+            logger.info(line)
+
+
+@command(
+    [
+        argument("file", help="A YAML file of the mock servers."),
+        argument('--log-config', help="A YAML file that include logging configs."),
+    ],
+)
+def mocks(args: Namespace) -> None:
+    """
+    Run local stand-ins of rclone rc, Plex and FF with latency, errors and rate limits until stopped.
+    """
+    from mocks import start_mocks
+    with open(args.file) as file:
+        servers = start_mocks(yaml.safe_load(file) or {})
+    try:
+        while True:
+            time.sleep(10)
+    except WatchdogShutdown:
+        pass
+    for server in servers:
+        server.stop()
+
+
+@command(
+    [
+        argument("tricks_file", help="A YAML file that include tricks."),
+        argument("events_file", help="A JSON lines file of events recorded by RecordConduit."),
+        argument("--mocks", help="A YAML file of the mock servers to start first."),
+        argument("--speed", type=float, default=0, help="1 keeps the recorded intervals, 0 sends the events at once."),
+        argument("--output", help="Write the results to this JSON file."),
+        argument('--log-config', help="A YAML file that include logging configs."),
+    ],
+)
+def load(args: Namespace) -> None:
+    """
+    Replay recorded events through the tricks and measure the throughput and the latency of each conduit.
+    """
+    import json
+    from mocks import start_mocks
+    from bench import replay_events, read_events, LATENCY_BUCKETS
+    servers = []
+    if args.mocks:
+        with open(args.mocks) as file:
+            servers = start_mocks(yaml.safe_load(file) or {})
+    try:
+        config = load_config(args.tricks_file)
+        if config.get('python_path'):
+            add_to_sys_path(config['python_path'])
+        if config.get('http'):
+            SESSIONS.configure(**config['http'])
+        # before the tricks wrap the flows of their conduits
+        METRICS.configure(**{'buckets': LATENCY_BUCKETS, **(config.get('metrics') or {})})
+        default_dir = pathlib.Path(args.tricks_file).parent.name or os.path.relpath(os.getcwd())
+        handlers = []
+        for index, trick in enumerate(config[CONFIG_KEY_TRICKS]):
+            for name, value in list(trick.items()):
+                dirs = [os.path.abspath(dir) for dir in value.pop('dirs', [default_dir])]
+                recursive = value.pop('recursive', False)
+                handlers.append((build_trick(name, value, f'{pathlib.Path(args.tricks_file).name}#{index}'), dirs, recursive))
+        results = replay_events(handlers, read_events(args.events_file), args.speed)
+    finally:
+        for server in servers:
+            server.stop()
+    results['mocks'] = {server.NAME: dict(server.stats) for server in servers}
+    results['http'] = SESSIONS.stats()
+    METRICS.stop()
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        logger.info(f'Results: {args.output!r}')
+    else:
+        print(json.dumps(results, indent=2))
+
+
 def main() -> None:
     """Entry-point function."""
     if hasattr(signal, "SIGHUP"):